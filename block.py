@@ -1,28 +1,214 @@
 """Implementation to represent a single block in the custom blockchain"""
-import json
-from Crypto.Hash import SHA
-from merkle import MerkleTree
+import struct
+import hashlib
+from merkle import MerkleTree, compute_root
+from transaction import Transaction
+
+# nonce, arity, timestamp, bits
+HEADER_FIELDS = struct.Struct('>QBQI')
+# timestamp, bits
+PREFIX_FIELDS = struct.Struct('>QI')
+U8 = struct.Struct('>B')
+U16 = struct.Struct('>H')
+U32 = struct.Struct('>I')
+
+
+def header_prefix(prev_hash, merkle_root, timestamp=0, bits=0):
+    """Constant part of a block header, to which the nonce is appended
+
+    Args:
+        prev_hash (str)
+        merkle_root (str)
+        timestamp (int, optional): Milliseconds since the epoch
+        bits (int, optional): Compact proof of work target
+
+    Returns:
+        bytes
+    """
+    return ''.join([prev_hash, merkle_root]).encode('utf-8') + \
+        PREFIX_FIELDS.pack(timestamp, bits)
+
+
+def hash_header(prefix, nonce):
+    """Compute the hash of a block header
+
+    Args:
+        prefix (bytes): Header prefix returned by header_prefix
+        nonce (int)
+
+    Returns:
+        bytes: Raw SHA-1 digest
+    """
+    return hashlib.sha1(prefix + b'%d' % nonce).digest()
+
+
+class BlockHeader:
+    __slots__ = ('prev_hash', 'merkle_root', 'nonce', 'arity', 'timestamp',
+                 'bits', '_prefix', '_digest', '_hash')
+
+    def __init__(self,
+                 prev_hash,
+                 merkle_root,
+                 nonce=0,
+                 arity=0,
+                 timestamp=0,
+                 bits=0):
+        """BlockHeader Ctor
+
+        Args:
+            prev_hash (str): Hash of the previous block on the blockchain.
+            merkle_root (str): Merkle root of the transactions of the block
+            nonce (int, optional): Defaults to 0.
+            arity (int, optional): Arity of the Merkle Tree. Defaults to 0.
+            timestamp (int, optional): Milliseconds since the epoch at which
+                the block was mined. Defaults to 0.
+            bits (int, optional): Compact proof of work target of the block,
+                see miner.compact_target. Defaults to 0.
+        """
+        self.prev_hash = prev_hash
+        self.merkle_root = merkle_root
+        self.nonce = nonce
+        self.arity = arity
+        self.timestamp = timestamp
+        self.bits = bits
+        self._prefix = None
+        self._digest = None
+        self._hash = None
+
+    def prefix(self):
+        """Return the part of the header that does not depend on nonce
+
+        Returns:
+            bytes
+        """
+        if self._prefix is None:
+            self._prefix = header_prefix(self.prev_hash, self.merkle_root,
+                                         self.timestamp, self.bits)
+        return self._prefix
+
+    def set_nonce(self, nonce):
+        self.nonce = nonce
+        self._digest = None
+        self._hash = None
+
+    def digest(self):
+        """Return the raw hash of the header, computed once per nonce. It is
+        compared to the proof of work target as bytes.
+
+        Returns:
+            bytes
+        """
+        if self._digest is None:
+            self._digest = hash_header(self.prefix(), self.nonce)
+        return self._digest
+
+    def get_hash(self):
+        """Return the hash of the header as hex
+
+        Returns:
+            str
+        """
+        if self._hash is None:
+            self._hash = self.digest().hex()
+        return self._hash
+
+    def to_bytes(self):
+        """Canonical form of the header, with raw 20-byte digests
+
+        Returns:
+            bytes
+        """
+        prev_hash = bytes.fromhex(self.prev_hash)
+        merkle_root = bytes.fromhex(self.merkle_root)
+        return b''.join([
+            U8.pack(len(prev_hash)), prev_hash,
+            U8.pack(len(merkle_root)), merkle_root,
+            HEADER_FIELDS.pack(self.nonce, self.arity, self.timestamp,
+                               self.bits)
+        ])
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Inverse of to_bytes
+
+        Args:
+            data (bytes)
+            offset (int, optional): Position of the header in data
+
+        Returns:
+            tuple: (BlockHeader, offset just after the header)
+        """
+        size = data[offset]
+        prev_hash = data[offset + 1:offset + 1 + size].hex()
+        offset += 1 + size
+        size = data[offset]
+        merkle_root = data[offset + 1:offset + 1 + size].hex()
+        offset += 1 + size
+        nonce, arity, timestamp, bits = HEADER_FIELDS.unpack_from(data, offset)
+        return cls(prev_hash, merkle_root, nonce, arity, timestamp,
+                   bits), offset + HEADER_FIELDS.size
+
+    def to_json(self):
+        """Return the JSON of the header, whose fields are also those of
+        the JSON of a block
+
+        Returns:
+            dict
+        """
+        return {
+            "prev_hash": self.prev_hash,
+            "merkle_root": self.merkle_root,
+            "nonce": self.nonce,
+            "arity": self.arity,
+            "timestamp": self.timestamp,
+            "bits": self.bits
+        }
+
+    @classmethod
+    def from_json(cls, header):
+        """Inverse of to_json
+
+        Args:
+            header (dict)
+
+        Returns:
+            BlockHeader instance
+        """
+        return cls(header['prev_hash'], header['merkle_root'],
+                   header['nonce'], header['arity'], header['timestamp'],
+                   header['bits'])
 
 
 class Block:
-    def __init__(self, transactions, arity, prev_hash=''):
+    __slots__ = ('header', 'transactions')
+
+    def __init__(self,
+                 transactions,
+                 arity,
+                 prev_hash='',
+                 merkle_root=None,
+                 nonce=0,
+                 timestamp=0,
+                 bits=0):
         """Block Ctor
 
         Args:
-            transactions (List): Each transaction is of type JSON
+            transactions (List[Transaction]): Signed transactions of the block
             arity (int): Arity of the Merkle Tree to hold the block
             prev_hash (str): Hash of the previous block on the blockchain.
+            merkle_root (str, optional): Precomputed root of the
+                transactions. Computed from the transactions if not given.
+            nonce (int, optional): Defaults to 0.
+            timestamp (int, optional): See BlockHeader. Defaults to 0.
+            bits (int, optional): See BlockHeader. Defaults to 0.
         """
         self.transactions = transactions
-        self.hash = None
-        self.prev_hash = prev_hash
-        self.nonce = 0
-        self.merkle = MerkleTree(arity)
 
-        # Contruct tree and compute hash
-        if arity != 0:
-            self.merkle.construct_tree(self.transactions)
-        self.compute_hash()
+        # Compute the merkle root of the transactions
+        if merkle_root is None:
+            merkle_root = compute_root(transactions, arity) if arity else ''
+        self.header = BlockHeader(prev_hash, merkle_root, nonce, arity,
+                                  timestamp, bits)
 
     @classmethod
     def genesis_block(cls):
@@ -33,30 +219,133 @@ class Block:
         """
         return cls([], 0)
 
+    @classmethod
+    def from_header(cls, header, transactions):
+        """Ctor from a received header and the transactions it commits to
+
+        Args:
+            header (BlockHeader)
+            transactions (List[Transaction])
+
+        Returns:
+            Block instance
+        """
+        block = cls.__new__(cls)
+        block.header = header
+        block.transactions = transactions
+        return block
+
+    @classmethod
+    def from_json(cls, blk):
+        """Ctor from the JSON of a block with raw signatures (Format in README)
+
+        Args:
+            blk (dict)
+
+        Returns:
+            Block instance
+        """
+        transactions = [
+            Transaction.from_json(tx, signature)
+            for tx, signature in zip(blk['transactions'], blk['signatures'])
+        ]
+        return cls.from_header(BlockHeader.from_json(blk), transactions)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Inverse of to_bytes
+
+        Args:
+            data (bytes)
+            offset (int, optional): Position of the block in data
+
+        Returns:
+            tuple: (Block, offset just after the block)
+        """
+        header, offset = BlockHeader.from_bytes(data, offset)
+        count, = U32.unpack_from(data, offset)
+        offset += U32.size
+
+        transactions = []
+        for _ in range(count):
+            size, = U16.unpack_from(data, offset)
+            tx_data = data[offset + 2:offset + 2 + size]
+            offset += 2 + size
+            size, = U16.unpack_from(data, offset)
+            signature = bytes(data[offset + 2:offset + 2 + size])
+            offset += 2 + size
+            transactions.append(Transaction.from_bytes(tx_data, signature))
+
+        return cls.from_header(header, transactions), offset
+
+    @property
+    def prev_hash(self):
+        return self.header.prev_hash
+
+    @property
+    def merkle_root(self):
+        return self.header.merkle_root
+
+    @property
+    def arity(self):
+        return self.header.arity
+
+    @property
+    def nonce(self):
+        return self.header.nonce
+
+    @property
+    def timestamp(self):
+        return self.header.timestamp
+
+    @property
+    def bits(self):
+        return self.header.bits
+
     def to_json(self):
         """Return a json dump of the block to send out to other nodes
 
         Returns:
-            str
+            dict
         """
-        blk_dict = {
-            "prev_hash": self.prev_hash,
-            "nonce": self.nonce,
-            "merkle_root": self.merkle.root.value,
-            "arity": self.merkle.arity,
-            "transactions": self.transactions
-        }
+        blk_dict = self.header.to_json()
+        blk_dict['transactions'] = [tx.to_json() for tx in self.transactions]
+        blk_dict['signatures'] = [tx.signature for tx in self.transactions]
         return blk_dict
 
+    def to_bytes(self):
+        """Canonical form of the block, which is signed by its miner
+
+        Returns:
+            bytes
+        """
+        parts = [self.header.to_bytes(), U32.pack(len(self.transactions))]
+        for tx in self.transactions:
+            tx_bytes = tx.to_bytes()
+            parts.append(U16.pack(len(tx_bytes)))
+            parts.append(tx_bytes)
+            parts.append(U16.pack(len(tx.signature)))
+            parts.append(tx.signature)
+        return b''.join(parts)
+
+    def merkle_tree(self):
+        """Build the full Merkle Tree of the block, needed for inclusion
+        proofs
+
+        Returns:
+            MerkleTree
+        """
+        merkle = MerkleTree(self.arity)
+        merkle.construct_tree(self.transactions)
+        return merkle
+
     def set_nonce(self, nonce):
         """Used when the nonce has been calculated by some other node
 
         Args:
             nonce (int)
         """
-        self.nonce = nonce
-        # Re-compute hash since the nonce has changed
-        self.compute_hash()
+        self.header.set_nonce(nonce)
 
     def compute_hash(self):
         """Compute and return the hash of block instance
@@ -64,10 +353,15 @@ class Block:
         Returns:
             String: hash of the current block header
         """
-        block_header = ''.join(
-            [str(self.nonce), self.prev_hash, self.merkle.root.value])
-        self.hash = SHA.new(block_header.encode('utf-8')).hexdigest()
-        return self.hash
+        return self.header.get_hash()
+
+    def header_prefix(self):
+        """Return the part of the block header that does not depend on nonce
+
+        Returns:
+            bytes
+        """
+        return self.header.prefix()
 
     def get_hash(self):
         """Return the saved hash of the current instance
@@ -75,6 +369,4 @@ class Block:
         Returns:
             str
         """
-        if not self.hash:
-            return self.compute_hash()
-        return self.hash
\ No newline at end of file
+        return self.header.get_hash()
@@ -1,54 +1,472 @@
 """Implementation of the blockchain protocol which will be used by all the nodes on the BatCoin network"""
-import json
+import time
+from collections import OrderedDict, deque
 from block import *
-from datetime import datetime
+from merkle import MerkleAccumulator, compute_root
+from ledger import Ledger
+from mempool import Mempool
+from miner import SerialMiner, compact_target, expand_target, pow_target
+from orphans import OrphanPool
+
+# Blocks over which the time taken to mine is measured when retargeting
+RETARGET_WINDOW = 20
+# A block is timestamped after the median of this many blocks before it
+MEDIAN_TIME_SPAN = 11
+# Milliseconds a block timestamp may be ahead of the clock of the node
+MAX_FUTURE_DRIFT = 60000
+# Blocks held until the clock reaches their timestamp, the oldest being
+# dropped
+MAX_FUTURE_BLOCKS = 64
+# Retargeting never makes the target more than this many times the initial
+# one
+MAX_TARGET_FACTOR = 2**8
 
 
 class Blockchain:
-    def __init__(self, block_size, arity, difficulty):
+    def __init__(self, block_size, arity, difficulty, miner=None,
+                 verifier=None, store=None, block_interval=None,
+                 clock=time.time, check_pow=True):
         self.block_length = block_size
         self.arity = arity
         self.difficulty = difficulty
+        # Initial target, and the easiest one retargeting may reach
+        self.target = pow_target(difficulty)
+        self.initial_bits = compact_target(int.from_bytes(self.target, 'big'))
+        self.max_target = min(
+            int.from_bytes(self.target, 'big') * MAX_TARGET_FACTOR,
+            2**160 - 1)
+        # Seconds between blocks aimed at by retargeting. The target stays
+        # the initial one if None.
+        self.block_interval = block_interval
+        self.clock = clock
+        # Nonces are neither searched nor checked if False, when the time to
+        # find a block is simulated. Headers still carry their target, so
+        # retargeting and the work of the chains are unchanged.
+        self.check_pow = check_pow
+        # Targets format - hash: bits required of the children of the block
+        self.targets = {}
+        # Expanded targets format - bits: target, for the bits seen valid
+        self.expanded_targets = {}
+        # Recent times format - hash: timestamps of the block and of up to
+        # MEDIAN_TIME_SPAN - 1 blocks before it, most recent first
+        self.recent_times = {}
+        # Proof of work engine - SerialMiner/ParallelMiner
+        self.miner = miner or SerialMiner()
+        # Signature checks of the transactions in blocks are skipped if None
+        self.verifier = verifier
+        # Blocks are kept on disk instead of the index if a BlockStore is set
+        self.store = store
         self.init_amt = 10
         self.reward = 2
-        self.transactions = []
-
-        # Chain format - (block, prev_id_block)
-        self.chain = []
-        self.main = -1
-        # Orphans format - (block)
-        self.orphans = []
-        self.create_genesis_block()
+        # Pending transactions, in the order they are mined
+        self.mempool = Mempool(self.__account_of)
+        # Balances at the tip of the main chain
+        self.ledger = Ledger(self.init_amt, self.reward, self.__account_of)
+        # Transactions of the last block template, in the order they were
+        # added to it, and their Merkle frontier
+        self.template_txs = []
+        self.pending_merkle = MerkleAccumulator(arity)
+
+        # Index format - hash: (block, parent_hash, height, work), where
+        # block is None if it is read from the store
+        self.index = {}
+        # Hash of the tip of the main chain
+        self.main = None
+        # Blocks with illegal transactions, and their descendants
+        self.invalid = set()
+        # Blocks waiting for their parent, indexed by the missing parent hash
+        self.orphans = OrphanPool(clock=clock)
+        # Future blocks format - hash: block too far ahead of the clock to be
+        # linked yet, in the order they arrived
+        self.future_blocks = OrderedDict()
+        # Headers format - hash: (header, height, work) of valid headers
+        # whose block is not in the index yet
+        self.headers = {}
+        # Tip of the heaviest header chain, if it is ahead of the main chain
+        self.best_header = None
+        # Called as listener(ancestor, disconnected, connected) when the main
+        # chain switches to another branch, with the hashes of the blocks
+        # rolled back and applied after the common ancestor, in chain order
+        self.reorg_listeners = []
+        if store is not None and store.tip is not None:
+            self.__load_store()
+        else:
+            self.create_genesis_block()
 
     def __str__(self):
         chain = 'Total blocks in blockchain: ' + str(len(
-            self.chain)) + '\nChain: \n'
-        main_chain = []
-        curr_index = self.main
-        while (curr_index != -1):
-            main_chain.append(self.chain[curr_index][0])
-            curr_index = self.chain[curr_index][1]
-        blockchain = ',\n'.join([block.get_hash() for block in main_chain])
+            self.index)) + '\nChain: \n'
+        blockchain = ',\n'.join(self.get_main_chain()[::-1])
         return chain + blockchain
 
     def __last_hash(self):
-        return self.chain[self.main][0].get_hash()
+        return self.main
+
+    def __account_of(self, node_id):
+        """Account debited by transactions of node `node_id`
+
+        Args:
+            node_id (int)
+
+        Returns:
+            str: Public key of the node, or the node id as a string if there
+                are no keys, like the receiver of a transaction
+        """
+        if self.verifier is None:
+            return str(node_id)
+        return self.verifier.get_key(node_id)
+
+    def block_work(self, bits):
+        """Expected number of hashes needed to mine a block
+
+        Args:
+            bits (int): Compact target of the block
+
+        Returns:
+            int
+        """
+        return 2**160 // (int.from_bytes(self.__target_of(bits), 'big') + 1)
+
+    def __target_of(self, bits):
+        """Expand the compact target of a header
+
+        Args:
+            bits (int)
+
+        Returns:
+            bytes: None if the target is easier than allowed
+        """
+        target = self.expanded_targets.get(bits)
+        if target is None:
+            target = expand_target(bits)
+            if target is None or \
+                    int.from_bytes(target, 'big') > self.max_target:
+                return None
+            self.expanded_targets[bits] = target
+        return target
+
+    def __misses_target(self, header, target):
+        return self.check_pow and header.digest() > target
+
+    def __header_of(self, block_hash):
+        entry = self.headers.get(block_hash)
+        return entry[0] if entry else self.get_block(block_hash).header
+
+    def __parent_of(self, block_hash):
+        entry = self.index.get(block_hash)
+        return entry[1] if entry else self.headers[block_hash][0].prev_hash
+
+    def __height_and_work(self, block_hash):
+        entry = self.index.get(block_hash) or self.headers[block_hash]
+        return entry[-2:]
+
+    def __recent_times(self, block_hash):
+        """Timestamps of a block and of the blocks before it, derived from
+        those of its parent
+
+        Args:
+            block_hash (str): Block in the index or the header chain
+
+        Returns:
+            tuple: Up to MEDIAN_TIME_SPAN timestamps, most recent first
+        """
+        times = self.recent_times.get(block_hash)
+        if times is None:
+            # Walk back to the closest block whose times are known
+            path = []
+            while block_hash is not None and \
+                    block_hash not in self.recent_times:
+                path.append(block_hash)
+                block_hash = self.__parent_of(block_hash)
+            times = self.recent_times.get(block_hash, ())
+            for block_hash in reversed(path):
+                times = (self.__header_of(block_hash).timestamp,
+                         ) + times[:MEDIAN_TIME_SPAN - 1]
+                self.recent_times[block_hash] = times
+        return times
+
+    def __timestamp(self, block_hash):
+        return self.__recent_times(block_hash)[0]
+
+    def __median_time(self, block_hash):
+        """Median timestamp of a block and of the blocks before it, up to
+        MEDIAN_TIME_SPAN blocks
+
+        Args:
+            block_hash (str): Block in the index or the header chain
+
+        Returns:
+            int
+        """
+        times = sorted(self.__recent_times(block_hash))
+        return times[len(times) // 2]
+
+    def next_bits(self, block_hash):
+        """Get the compact target required of the children of a block. It
+        is retargeted from the time the last RETARGET_WINDOW blocks took to
+        mine, and computed once per block.
+
+        Args:
+            block_hash (str): Block in the index or the header chain
+
+        Returns:
+            int
+        """
+        bits = self.targets.get(block_hash)
+        if bits is None:
+            bits = self.__retarget(block_hash)
+            self.targets[block_hash] = bits
+        return bits
+
+    def __retarget(self, block_hash):
+        height, work = self.__height_and_work(block_hash)
+        if self.block_interval is None or height <= RETARGET_WINDOW:
+            return self.initial_bits
+
+        ancestor = block_hash
+        for _ in range(RETARGET_WINDOW):
+            ancestor = self.__parent_of(ancestor)
+        expected = int(RETARGET_WINDOW * self.block_interval * 1000)
+        timespan = self.__timestamp(block_hash) - self.__timestamp(ancestor)
+        timespan = min(max(timespan, expected // 4), expected * 4)
+
+        # Work per block which would have mined the window in the expected
+        # time
+        window_work = work - self.__height_and_work(ancestor)[1]
+        block_work = max(
+            window_work * expected // (timespan * RETARGET_WINDOW), 1)
+        return compact_target(min(2**160 // block_work - 1, self.max_target))
+
+    def __check_context(self, header):
+        """Check the fields of a header which depend on the blocks before
+        it: its target, and a timestamp after their median
+
+        Args:
+            header (BlockHeader): Header whose parent is in the index or the
+                header chain
+
+        Returns:
+            boolean
+        """
+        return header.bits == self.next_bits(header.prev_hash) and \
+            header.timestamp > self.__median_time(header.prev_hash)
+
+    def __is_future(self, header):
+        """Whether a header is timestamped too far ahead of the clock. It
+        may become valid later, so it is never marked invalid."""
+        return header.timestamp > self.clock() * 1000 + MAX_FUTURE_DRIFT
+
+    def __load_store(self):
+        """Rebuild the index and the balances from the block store. Blocks
+        were validated before being stored, so only the ledger is replayed
+        on the main chain."""
+        for block_hash, parent, height, work in self.store.records:
+            self.index[block_hash] = (None, parent, height, work)
+        self.invalid = set(self.store.invalid)
+        self.main = self.store.tip
+        for block_hash in self.get_main_chain():
+            self.ledger.apply_block(block_hash,
+                                    self.get_block(block_hash).transactions)
+
+    def __add_to_index(self, block, parent, height, work):
+        block_hash = block.get_hash()
+        self.headers.pop(block_hash, None)
+        if self.store is not None:
+            self.store.append(block, parent, height, work)
+            block = None
+        self.index[block_hash] = (block, parent, height, work)
+
+    def __set_main(self, block_hash):
+        self.main = block_hash
+        if self.store is not None:
+            self.store.set_tip(block_hash)
+
+    def __mark_invalid(self, hashes):
+        self.invalid.update(hashes)
+        if self.store is not None:
+            for block_hash in hashes:
+                self.store.mark_invalid(block_hash)
+
+    def get_block(self, block_hash):
+        """Get a block of the index, reading it from the store if needed
+
+        Args:
+            block_hash (str)
 
-    def __get_chain_length(self, index):
-        """Get length of chain traversing back from index
+        Returns:
+            Block: None if the block is not in the index
+        """
+        entry = self.index.get(block_hash)
+        if entry is None:
+            return None
+        if entry[0] is None:
+            return self.store.get(block_hash)
+        return entry[0]
+
+    def get_height(self, block_hash=None):
+        """Get the height of a block in the index, genesis being at height 0
 
         Args:
-            index (int)
+            block_hash (str, optional): Defaults to the main chain tip.
 
         Returns:
-            int: Length
+            int: Height, or -1 if the block is not in the index
         """
-        curr_index = index
-        length = 0
-        while (curr_index != -1):
-            curr_index = self.chain[curr_index][1]
-            length += 1
-        return length
+        if block_hash is None:
+            block_hash = self.main
+        entry = self.index.get(block_hash)
+        return entry[2] if entry else -1
+
+    def get_work(self, block_hash=None):
+        """Get the cumulative work of the chain ending at a block of the
+        index
+
+        Args:
+            block_hash (str, optional): Defaults to the main chain tip.
+
+        Returns:
+            int: Work, or -1 if the block is not in the index
+        """
+        if block_hash is None:
+            block_hash = self.main
+        entry = self.index.get(block_hash)
+        return entry[3] if entry else -1
+
+    def get_main_chain(self):
+        """Get the hashes of the blocks on the main chain
+
+        Returns:
+            List: Hashes ordered from genesis to tip
+        """
+        main_chain = []
+        curr_hash = self.main
+        while curr_hash is not None:
+            main_chain.append(curr_hash)
+            curr_hash = self.index[curr_hash][1]
+        return main_chain[::-1]
+
+    def locator(self):
+        """Hashes of the main chain a peer looks up to find where its own
+        main chain forks from this one. The last 10 blocks are listed, then
+        exponentially sparser ones back to genesis.
+
+        Returns:
+            List[str]: Hashes from the tip back to genesis
+        """
+        chain = self.get_main_chain()
+        locator = []
+        step = 1
+        height = len(chain) - 1
+        while height > 0:
+            locator.append(chain[height])
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        locator.append(chain[0])
+        return locator
+
+    def headers_after(self, locator, max_count):
+        """Headers of the main chain following the first locator hash found
+        on it, or following genesis if there is none
+
+        Args:
+            locator (List[str]): Output of locator on the requesting node
+            max_count (int): Maximum headers returned
+
+        Returns:
+            List[BlockHeader]: Headers in chain order
+        """
+        chain = self.get_main_chain()
+        start = 1
+        for block_hash in locator:
+            height = self.get_height(block_hash)
+            if 0 <= height < len(chain) and chain[height] == block_hash:
+                start = height + 1
+                break
+        return [
+            self.get_block(block_hash).header
+            for block_hash in chain[start:start + max_count]
+        ]
+
+    def validate_headers(self, headers):
+        """Check the proof of work of a run of headers, and that each one
+        extends the previous one, without their transactions
+
+        Args:
+            headers (List[BlockHeader]): Headers in chain order
+
+        Returns:
+            int: Number of leading headers which are valid
+        """
+        prev_hash = headers[0].prev_hash if headers else None
+        for count, header in enumerate(headers):
+            if header.prev_hash != prev_hash:
+                return count
+            target = self.__target_of(header.bits)
+            if target is None or self.__misses_target(header, target):
+                return count
+            prev_hash = header.get_hash()
+        return len(headers)
+
+    def has_header(self, block_hash):
+        """Whether a block or its validated header is known
+
+        Args:
+            block_hash (str)
+
+        Returns:
+            boolean
+        """
+        return block_hash in self.index or block_hash in self.headers
+
+    def add_headers(self, headers):
+        """Validate a run of headers received ahead of their blocks and add
+        them to the header chain. This tracks the heaviest chain known to the
+        network before the transactions are downloaded.
+
+        Args:
+            headers (List[BlockHeader]): Headers in chain order, the first one
+                extending a known header
+
+        Returns:
+            int: Number of leading headers which are valid
+        """
+        if not headers:
+            return 0
+        parent = self.index.get(headers[0].prev_hash) or \
+            self.headers.get(headers[0].prev_hash)
+        if parent is None or headers[0].prev_hash in self.invalid:
+            return 0
+        count = self.validate_headers(headers)
+
+        height, work = parent[-2:]
+        best_work = self.__best_header_work()
+        for added, header in enumerate(headers[:count]):
+            height += 1
+            work += self.block_work(header.bits)
+            block_hash = header.get_hash()
+            if block_hash in self.index:
+                continue
+            if self.__is_future(header) or not self.__check_context(header):
+                return added
+            self.headers[block_hash] = (header, height, work)
+            if work > best_work:
+                self.best_header, best_work = block_hash, work
+        return count
+
+    def __best_header_work(self):
+        entry = self.headers.get(self.best_header)
+        return entry[2] if entry else self.index[self.main][3]
+
+    def get_header_height(self):
+        """Get the height of the heaviest header chain, which the main chain
+        reaches once the blocks behind it are downloaded
+
+        Returns:
+            int
+        """
+        entry = self.headers.get(self.best_header)
+        return max(entry[1] if entry else -1, self.get_height())
 
     def __append_to_chain(self, block):
         """Either append block to chain or add in orphans
@@ -56,107 +474,244 @@ class Blockchain:
         Args:
             block (Block)
         """
+        block_hash = block.get_hash()
+        if block_hash in self.index:
+            return
+
         # Special clause for first block addition
-        if self.main == -1:
+        if self.main is None:
             print('Adding first block')
-            self.chain.append((block, -1))
-            self.main += 1
-        else:
-            found_parent = False
-            for index in range(len(self.chain)):
-                p_index = len(self.chain) - index - 1
-                parent = self.chain[p_index][0]
-                if parent.get_hash() == block.prev_hash:
-                    self.chain.append((block, p_index))
-                    if p_index == self.main:
-                        self.main += 1
-                    else:
-                        # Check if the length of new branch is more, swap branch
-                        if self.__get_chain_length(
-                                self.main) < self.__get_chain_length(
-                                    len(self.chain) - 1):
-                            self.main = len(self.chain) - 1
-                    found_parent = True
-                    break
-            if not found_parent:
-                # Add in orphan pool
-                self.orphans.append(block)
+            self.__add_to_index(block, None, 0, 0)
+            self.ledger.apply_block(block_hash, block.transactions)
+            self.__set_main(block_hash)
+            return
+
+        if block.prev_hash not in self.index:
+            # Add in orphan pool
+            self.orphans.add(block)
+            return
+
+        # Attach the block, followed by the orphan subtree rooted at it.
+        # Siblings are linked in the order they arrived, so that the first
+        # seen wins a tie.
+        pending = deque([block])
+        while pending:
+            child = pending.popleft()
+            child_hash = child.get_hash()
+            if child_hash not in self.index:
+                if self.__is_future(child.header):
+                    # Its descendants stay orphans until it is linked
+                    self.future_blocks[child_hash] = child
+                    if len(self.future_blocks) > MAX_FUTURE_BLOCKS:
+                        self.future_blocks.popitem(last=False)
+                    continue
+                self.__link(child)
+            pending.extend(self.orphans.pop_children(child_hash))
+
+    def connect_future_blocks(self):
+        """Link the held blocks whose timestamp the clock has caught up with
+
+        Returns:
+            boolean: True if some block was linked
+        """
+        ready = [
+            blk for blk in self.future_blocks.values()
+            if not self.__is_future(blk.header)
+        ]
+        for blk in ready:
+            del self.future_blocks[blk.get_hash()]
+            self.__append_to_chain(blk)
+        return bool(ready)
+
+    def __link(self, block):
+        """Insert a block whose parent is already in the index
+
+        Args:
+            block (Block)
+        """
+        block_hash = block.get_hash()
+        parent = self.index[block.prev_hash]
+        height = parent[2] + 1
+        work = parent[3] + self.block_work(block.bits)
+        self.__add_to_index(block, block.prev_hash, height, work)
+
+        if block.prev_hash in self.invalid or \
+                not self.__check_context(block.header):
+            self.__mark_invalid([block_hash])
+            return
+
+        # Swap branch if the new block's branch has more work than the main
+        # chain. On a tie the branch seen first, the main chain, is kept.
+        if work > self.index[self.main][3]:
+            if block.prev_hash == self.main:
+                if self.ledger.apply_block(block_hash, block.transactions):
+                    self.mempool.remove(block.transactions)
+                    self.__set_main(block_hash)
+                else:
+                    self.__mark_invalid([block_hash])
             else:
-                # Check if some block in orphan pool is a child
-                for orphan in self.orphans:
-                    if block.get_hash() == orphan.get_hash():
-                        self.__append_to_chain(orphan)
-                        break
+                self.__reorganize(block_hash)
+
+    def __branches(self, old_tip, new_tip):
+        """Walk two chains of the index back to their common ancestor
+
+        Args:
+            old_tip (str)
+            new_tip (str)
+
+        Returns:
+            tuple: (ancestor hash, blocks of the old chain after it from the
+                tip down, blocks of the new chain after it in chain order)
+        """
+        old_hash, new_hash = old_tip, new_tip
+        old_branch, new_branch = [], []
+        while self.index[new_hash][2] > self.index[old_hash][2]:
+            new_branch.append(new_hash)
+            new_hash = self.index[new_hash][1]
+        while self.index[old_hash][2] > self.index[new_hash][2]:
+            old_branch.append(old_hash)
+            old_hash = self.index[old_hash][1]
+        while old_hash != new_hash:
+            old_branch.append(old_hash)
+            new_branch.append(new_hash)
+            old_hash = self.index[old_hash][1]
+            new_hash = self.index[new_hash][1]
+        new_branch.reverse()
+        return old_hash, old_branch, new_branch
+
+    def main_chain_since(self, block_hash):
+        """Get the blocks of the main chain after its common ancestor with
+        the chain ending at a block, such as a former tip. Only walks back to
+        that ancestor.
+
+        Args:
+            block_hash (str): Block of the index
+
+        Returns:
+            tuple: (height of the ancestor, List of hashes after it up to
+                the tip)
+        """
+        ancestor, _, added = self.__branches(block_hash, self.main)
+        return self.index[ancestor][2], added
+
+    def __reorganize(self, new_tip):
+        """Switch the main chain to the branch ending at `new_tip`. Only the
+        blocks after the common ancestor are rolled back and replayed on the
+        ledger. The main chain is kept if the new branch has an illegal block.
+        The reorg listeners are called once the switch is done.
+
+        Args:
+            new_tip (str): Hash of the tip of the new branch
+        """
+        old_hash, old_branch, new_branch = self.__branches(self.main, new_tip)
+
+        blocks = {
+            block_hash: self.get_block(block_hash)
+            for block_hash in old_branch + new_branch
+        }
+        for block_hash in old_branch:
+            self.ledger.rollback_block(block_hash)
+        for applied, block_hash in enumerate(new_branch):
+            block = blocks[block_hash]
+            if not self.ledger.apply_block(block_hash, block.transactions):
+                # Restore the main chain, and never consider this branch again
+                for undo_hash in reversed(new_branch[:applied]):
+                    self.ledger.rollback_block(undo_hash)
+                for redo_hash in reversed(old_branch):
+                    self.ledger.apply_block(redo_hash,
+                                            blocks[redo_hash].transactions)
+                self.__mark_invalid(new_branch[applied:])
+                return
+
+        # Transactions of the abandoned blocks are pending again, unless the
+        # new branch confirms them too. Rewards are only valid in their block.
+        for block_hash in old_branch:
+            for tx in blocks[block_hash].transactions:
+                if tx.type != 'MINE':
+                    self.mempool.add(tx)
+        for block_hash in new_branch:
+            self.mempool.remove(blocks[block_hash].transactions)
+        self.__set_main(new_tip)
+        old_branch.reverse()
+        for listener in self.reorg_listeners:
+            listener(old_hash, old_branch, new_branch)
 
     def create_genesis_block(self):
         first_block = Block.genesis_block()
         self.__append_to_chain(first_block)
 
     def validate_block(self, blk):
-        """Validate the block JSON
+        """Validate a block received from another node
 
         Args:
-            blk (dict): Block object to validate (Format in README)
+            blk (Block): Block object to validate
 
         Returns:
             Object: None if not valid, otherwise returns the next block
         """
         # Verify if POW done on the block
-        block_header = ''.join(
-            [str(blk['nonce']), blk['prev_hash'], blk['merkle_root']])
-        block_hash = SHA.new(block_header.encode('utf-8')).hexdigest()
-
-        target = 2**(160 - self.difficulty)
-        if int(block_hash, 16) > target:
+        target = self.__target_of(blk.bits)
+        if target is None or self.__misses_target(blk.header, target):
             return None
 
-        # Validate the transactions in the block, by re-constructing the merkle tree
-        # Currently, validates that the transactions in the block give the correct merkle root
-        # TODO: Also validate if the transactions are valid
-        next_block = Block(blk['transactions'], blk['arity'], blk['prev_hash'])
-        if next_block.merkle.root.value == blk['merkle_root']:
-            next_block.set_nonce(blk['nonce'])
-            return next_block
+        # Validate that every transaction was signed by its sender. Those
+        # already authenticated by this node are found in the verifier cache.
+        if self.verifier is not None:
+            items = [(tx.sender, tx.to_bytes(), tx.signature)
+                     for tx in blk.transactions]
+            if not all(self.verifier.verify_batch(items)):
+                return None
+
+        # Validate that the transactions in the block give the correct merkle
+        # root. Their legality is checked by the ledger once the block joins
+        # a chain.
+        if blk.arity >= 2 and compute_root(blk.transactions,
+                                           blk.arity) == blk.merkle_root:
+            return blk
 
         # Validation failed
         return None
 
     def validate_transaction(self, tx):
-        """Validate the transaction JSON
+        """Validate a transaction received from another node
 
         Args:
-            tx (dict): Transaction object to validate
+            tx (Transaction): Transaction object to validate
 
         Returns:
             boolean: True if legal else False
         """
-        if tx['type'] == 'INIT':
+        if tx.type == 'MINE':
+            # Rewards only enter the chain in the block of their miner
+            return False
+        if tx.type == 'INIT':
             # Validate the initial transaction
-            if tx['amount'] != self.init_amt or len(self.chain) > 1:
+            if tx.amount != self.init_amt or len(self.index) > 1:
+                return False
+            if self.mempool.has_init(tx.receiver):
                 return False
-            for transaction in self.transactions:
-                if transaction['receiver'] == tx['receiver']:
-                    return False
 
-        # TODO: Add more checks for non init transactions
-        return True
+        # Validate against the balances, less what is already being spent
+        pending = self.mempool.pending_debit(self.__account_of(tx.sender))
+        return self.ledger.check(tx, pending)
 
     def add_block(self, block):
         """Validate the block and add it to the chain, if valid
 
         Args:
-            block (string): Digitally signed JSON dump of the transaction
+            block (dict): Decoded payload of the digitally signed block
         
         Returns:
             boolean: True if block could be added.
         """
-        blk = json.loads(block)['blk']
+        self.connect_future_blocks()
+        blk = block['blk']
         next_block = self.validate_block(blk)
 
         if next_block:
             # Add block and update last hash
             self.__append_to_chain(next_block)
-            return True
+            return next_block.get_hash() not in self.invalid
 
         return False
 
@@ -164,44 +719,120 @@ class Blockchain:
         """Validate the transaction and add it to the unconfirmed block
 
         Args:
-            transaction (string): Digitally signed JSON dump of the transaction
+            transaction (dict): Decoded payload of the digitally signed transaction
         
         Returns:
             boolean: whether the Blockchain is ready for mining
         """
-        # Validate the transaction
-        tx = json.loads(transaction)['tx']
-        is_legal = self.validate_transaction(tx)
+        return self.add_transactions([transaction])
 
-        if is_legal:
-            self.transactions.append(tx)
-            if len(self.transactions) >= self.block_length:
-                return True
+    def add_transactions(self, transactions):
+        """Validate a batch of transactions in arrival order and add the legal
+        ones to the unconfirmed block, checking readiness once
 
-        # No block to add yet
-        return False
+        Args:
+            transactions (List[dict]): Decoded payloads of digitally signed
+                transactions
 
-    def proof_of_work(self, reward_tx):
-        """Compute the proof of work of the accumulated transactions
+        Returns:
+            boolean: whether the Blockchain is ready for mining
+        """
+        for transaction in transactions:
+            tx = transaction['tx']
+            if tx.digest() not in self.mempool and \
+                    self.validate_transaction(tx):
+                self.mempool.add(tx)
+        return self.ready_to_mine()
+
+    def block_template(self, reward_tx):
+        """Create the next block on the main chain from pending transactions,
+        without computing the proof of work. The transactions of the previous
+        template are kept first, while they are all still pending and legal,
+        and the free slots are filled with the highest priority ones. The
+        merkle root is derived from the frontier of the previous template, so
+        refreshing the template with new transactions or a new reward costs
+        O(log n) hashes per transaction added.
 
         Args:
-            reward_tx (string): Digitally signed JSON of the reward transaction
+            reward_tx (Transaction): Signed reward transaction
 
         Returns:
-            Block: The created block along with POW
+            Block: Block with nonce 0
         """
-        transactions = self.transactions[:self.block_length]
-        self.transactions = self.transactions[self.block_length:]
-        transactions.append(reward_tx)
-        block = Block(transactions, self.arity, self.__last_hash())
+        # Skip transactions made illegal by blocks accepted since they arrived
+        spent = {}
+
+        def is_legal(tx):
+            if tx.type == 'MINE':
+                return False
+            account = self.__account_of(tx.sender)
+            if not self.ledger.check(tx, spent.get(account, 0)):
+                return False
+            if tx.type == 'TRANSFER':
+                spent[account] = spent.get(account, 0) + tx.amount
+            return True
 
-        max_nonce = 2**32
-        target = 2**(160 - self.difficulty)
+        if not all(tx.digest() in self.mempool and is_legal(tx)
+                   for tx in self.template_txs):
+            # Mined by a block, or made illegal by one
+            spent.clear()
+            self.template_txs = []
+            self.pending_merkle = MerkleAccumulator(self.arity)
+        for tx in self.mempool.select(
+                self.block_length - len(self.template_txs), is_legal,
+                {tx.digest() for tx in self.template_txs}):
+            self.template_txs.append(tx)
+            self.pending_merkle.append(tx)
+
+        merkle_root = self.pending_merkle.root_with(reward_tx)
+        timestamp = max(int(self.clock() * 1000),
+                        self.__median_time(self.main) + 1)
+        return Block(self.template_txs + [reward_tx], self.arity,
+                     self.__last_hash(), merkle_root, 0, timestamp,
+                     self.next_bits(self.main))
+
+    def find_nonce(self, block, cancel=None):
+        """Compute the proof of work of a block template. Only touches the
+        block, so it can run outside the thread owning the Blockchain.
 
-        # Compute the nonce of the block
-        computed_hash = block.compute_hash()
-        while int(computed_hash, 16) > target:
-            block.nonce += 1
-            computed_hash = block.compute_hash()
+        Args:
+            block (Block): Template returned by block_template
+            cancel (threading.Event, optional): Search is abandoned once set
 
+        Returns:
+            Block: The block with its nonce set, None if cancelled
+        """
+        if not self.check_pow:
+            return block
+        nonce = self.miner.mine(block.header_prefix(),
+                                self.__target_of(block.bits), cancel)
+        if nonce is None:
+            return None
+        block.set_nonce(nonce)
         return block
+
+    def commit_template(self, block):
+        """Drop the pending transactions included in a mined block template
+
+        Args:
+            block (Block): Template returned by block_template
+        """
+        self.mempool.remove(block.transactions)
+
+    def can_fill_template(self):
+        """Whether the last block template has free slots which pending
+        transactions may fill
+
+        Returns:
+            boolean
+        """
+        return len(self.template_txs) < self.block_length and \
+            len(self.mempool) > len(self.template_txs)
+
+    def ready_to_mine(self):
+        """Whether enough transactions are pending to fill a block
+
+        Returns:
+            boolean
+        """
+        return len(self.mempool) >= self.block_length
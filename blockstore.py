@@ -0,0 +1,180 @@
+"""Append-only storage of the blocks of a node, to restart without
+rebuilding the chain from the genesis block"""
+import os
+import mmap
+import struct
+from block import Block
+
+# Journal record format - kind, hash, parent hash, segment, offset, height,
+# work. A record is appended for every stored block, every block marked
+# invalid and every change of the main chain tip.
+RECORD = struct.Struct('>B20s20sIQIQ')
+KIND_BLOCK, KIND_INVALID, KIND_TIP = 0, 1, 2
+NO_HASH = bytes(20)
+
+# Every block in a segment is preceded by its size
+U32 = struct.Struct('>I')
+
+
+class BlockStore:
+    def __init__(self, directory, segment_size=16 * 2**20):
+        """BlockStore Ctor. Blocks are appended to segment files, and read
+        back through memory maps so that old blocks do not stay in memory.
+
+        Args:
+            directory (str): Directory holding the segments and the journal
+            segment_size (int, optional): Bytes written to a segment before
+                starting a new one. Defaults to 16 MiB.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Locations format - hash: (segment, offset)
+        self.locations = {}
+        # Stored blocks in the order they were added, as tuples of
+        # (hash, parent_hash, height, work)
+        self.records = []
+        # Blocks marked invalid
+        self.invalid = set()
+        # Hash of the last main chain tip
+        self.tip = None
+        # Maps format - segment: mmap, remapped once the segment grows
+        self.maps = {}
+
+        self.segment = 0
+        self.__load_journal()
+        self.writer = open(self.__segment_path(self.segment), 'ab')
+        self.journal = open(self.__journal_path(), 'ab')
+
+    def __segment_path(self, segment):
+        return os.path.join(self.directory, 'blocks_%05d.dat' % segment)
+
+    def __journal_path(self):
+        return os.path.join(self.directory, 'journal.dat')
+
+    def __load_journal(self):
+        """Read the journal, dropping the records of blocks whose bytes never
+        reached their segment and a trailing record cut short by a crash"""
+        path = self.__journal_path()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as journal:
+            data = journal.read()
+        valid = len(data) - len(data) % RECORD.size
+
+        sizes = {}
+        for start in range(0, valid, RECORD.size):
+            kind, raw_hash, raw_parent, segment, offset, height, work = \
+                RECORD.unpack_from(data, start)
+            block_hash = raw_hash.hex()
+            if kind == KIND_BLOCK:
+                if segment not in sizes:
+                    sizes[segment] = self.__segment_bytes(segment)
+                if offset >= sizes[segment]:
+                    valid = start
+                    break
+                parent = raw_parent.hex() if height else None
+                self.locations[block_hash] = (segment, offset)
+                self.records.append((block_hash, parent, height, work))
+                self.segment = max(self.segment, segment)
+            elif kind == KIND_INVALID:
+                self.invalid.add(block_hash)
+            elif kind == KIND_TIP:
+                self.tip = block_hash
+
+        if valid < len(data):
+            with open(path, 'r+b') as journal:
+                journal.truncate(valid)
+
+    def __segment_bytes(self, segment):
+        path = self.__segment_path(segment)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def __contains__(self, block_hash):
+        return block_hash in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __record(self, kind, block_hash, parent=None, segment=0, offset=0,
+                 height=0, work=0):
+        raw_parent = bytes.fromhex(parent) if parent else NO_HASH
+        self.journal.write(
+            RECORD.pack(kind, bytes.fromhex(block_hash), raw_parent, segment,
+                        offset, height, work))
+        self.journal.flush()
+
+    def append(self, block, parent, height, work):
+        """Store a block linked into the index of the chain. The block bytes
+        are flushed before the journal record pointing at them.
+
+        Args:
+            block (Block)
+            parent (str): Hash of the parent, None for the genesis block
+            height (int)
+            work (int): Cumulative work up to the block
+        """
+        block_hash = block.get_hash()
+        if block_hash in self.locations:
+            return
+
+        offset = self.writer.tell()
+        if offset >= self.segment_size:
+            self.writer.close()
+            self.segment += 1
+            self.writer = open(self.__segment_path(self.segment), 'ab')
+            offset = 0
+
+        data = block.to_bytes()
+        self.writer.write(U32.pack(len(data)) + data)
+        self.writer.flush()
+
+        self.__record(KIND_BLOCK, block_hash, parent, self.segment, offset,
+                      height, work)
+        self.locations[block_hash] = (self.segment, offset)
+        self.records.append((block_hash, parent, height, work))
+
+    def mark_invalid(self, block_hash):
+        if block_hash not in self.invalid:
+            self.invalid.add(block_hash)
+            self.__record(KIND_INVALID, block_hash)
+
+    def set_tip(self, block_hash):
+        if block_hash != self.tip:
+            self.tip = block_hash
+            self.__record(KIND_TIP, block_hash)
+
+    def get(self, block_hash):
+        """Read a stored block
+
+        Args:
+            block_hash (str)
+
+        Returns:
+            Block: None if the block is not stored
+        """
+        location = self.locations.get(block_hash)
+        if location is None:
+            return None
+        segment, offset = location
+
+        data = self.maps.get(segment)
+        if data is None or offset + U32.size > len(data) or \
+                offset + U32.size + U32.unpack_from(data, offset)[0] > len(data):
+            # The segment grew since it was mapped
+            if data is not None:
+                data.close()
+            with open(self.__segment_path(segment), 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = data
+
+        block, _ = Block.from_bytes(data, offset + U32.size)
+        return block
+
+    def close(self):
+        self.writer.close()
+        self.journal.close()
+        for data in self.maps.values():
+            data.close()
+        self.maps = {}
@@ -0,0 +1,168 @@
+"""Compact form of a block, announcing it by its header and short ids of its
+transactions, which receivers look up in their own mempool"""
+import struct
+from block import Block, BlockHeader
+from transaction import SHORT_ID_SIZE, Transaction
+
+U16 = struct.Struct('>H')
+U32 = struct.Struct('>I')
+
+
+class CompactBlock:
+    __slots__ = ('header', 'count', 'short_ids', 'prefilled')
+
+    def __init__(self, header, count, short_ids, prefilled):
+        """CompactBlock Ctor
+
+        Args:
+            header (BlockHeader)
+            count (int): Number of transactions in the block
+            short_ids (List[bytes]): Short ids of the transactions which are
+                not prefilled, in block order
+            prefilled (List[tuple]): (index, Transaction) of the
+                transactions sent in full
+        """
+        self.header = header
+        self.count = count
+        self.short_ids = short_ids
+        self.prefilled = prefilled
+
+    @classmethod
+    def from_block(cls, block):
+        """Ctor from a full block. Rewards are sent in full, as they are
+        never in the mempool of another node.
+
+        Args:
+            block (Block)
+
+        Returns:
+            CompactBlock instance
+        """
+        short_ids, prefilled = [], []
+        for index, tx in enumerate(block.transactions):
+            if tx.type == 'MINE':
+                prefilled.append((index, tx))
+            else:
+                short_ids.append(tx.short_id())
+        return cls(block.header, len(block.transactions), short_ids,
+                   prefilled)
+
+    def get_hash(self):
+        return self.header.get_hash()
+
+    def fill(self, lookup):
+        """Place the transactions of the block found by short id
+
+        Args:
+            lookup (callable): Returns the Transaction with a short id, or
+                None if it is not known
+
+        Returns:
+            List[Transaction]: Transactions of the block, None where missing
+        """
+        transactions = [None] * self.count
+        for index, tx in self.prefilled:
+            transactions[index] = tx
+        short_ids = iter(self.short_ids)
+        for index in range(self.count):
+            if transactions[index] is None:
+                transactions[index] = lookup(next(short_ids))
+        return transactions
+
+    def to_block(self, transactions):
+        """Build the full block once every transaction is known
+
+        Args:
+            transactions (List[Transaction]): Output of fill, without holes
+
+        Returns:
+            Block
+        """
+        return Block.from_header(self.header, transactions)
+
+    def to_json(self):
+        """Return the JSON of the compact block with raw signatures of the
+        prefilled transactions
+
+        Returns:
+            dict
+        """
+        cmpct = self.header.to_json()
+        cmpct['count'] = self.count
+        cmpct['short_ids'] = [short_id.hex() for short_id in self.short_ids]
+        cmpct['prefilled'] = [[index, tx.to_json()]
+                              for index, tx in self.prefilled]
+        cmpct['signatures'] = [tx.signature for _, tx in self.prefilled]
+        return cmpct
+
+    @classmethod
+    def from_json(cls, cmpct):
+        """Inverse of to_json
+
+        Args:
+            cmpct (dict)
+
+        Returns:
+            CompactBlock instance
+        """
+        header = BlockHeader.from_json(cmpct)
+        prefilled = [
+            (index, Transaction.from_json(tx, signature))
+            for (index, tx), signature in zip(cmpct['prefilled'],
+                                              cmpct['signatures'])
+        ]
+        short_ids = [bytes.fromhex(short_id) for short_id in cmpct['short_ids']]
+        return cls(header, cmpct['count'], short_ids, prefilled)
+
+    def to_bytes(self):
+        parts = [
+            self.header.to_bytes(),
+            U32.pack(self.count),
+            U32.pack(len(self.prefilled))
+        ]
+        for index, tx in self.prefilled:
+            tx_bytes = tx.to_bytes()
+            parts.extend([
+                U32.pack(index),
+                U16.pack(len(tx_bytes)), tx_bytes,
+                U16.pack(len(tx.signature)), tx.signature
+            ])
+        parts.extend(self.short_ids)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Inverse of to_bytes
+
+        Args:
+            data (bytes)
+            offset (int, optional): Position of the compact block in data
+
+        Returns:
+            tuple: (CompactBlock, offset just after it)
+        """
+        header, offset = BlockHeader.from_bytes(data, offset)
+        count, num_prefilled = struct.unpack_from('>II', data, offset)
+        offset += 2 * U32.size
+
+        prefilled = []
+        for _ in range(num_prefilled):
+            index, size = struct.unpack_from('>IH', data, offset)
+            offset += U32.size + U16.size
+            tx_data = data[offset:offset + size]
+            offset += size
+            size, = U16.unpack_from(data, offset)
+            signature = bytes(data[offset + 2:offset + 2 + size])
+            offset += 2 + size
+            prefilled.append((index, Transaction.from_bytes(tx_data,
+                                                            signature)))
+
+        short_ids = []
+        for _ in range(count - num_prefilled):
+            short_ids.append(bytes(data[offset:offset + SHORT_ID_SIZE]))
+            offset += SHORT_ID_SIZE
+        indexes = set(index for index, _ in prefilled)
+        if offset > len(data) or len(indexes) != num_prefilled or \
+                any(index >= count for index in indexes):
+            raise ValueError('Malformed compact block')
+        return cls(header, count, short_ids, prefilled), offset
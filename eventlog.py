@@ -0,0 +1,79 @@
+"""Structured log of the events of a node, one JSON record per line"""
+import json
+import time
+
+
+class EventLog:
+    def __init__(self,
+                 path,
+                 node_id,
+                 buffer_size=256,
+                 flush_interval=1.0,
+                 clock=time.time,
+                 append=False):
+        """EventLog Ctor. Records are buffered and written in batches, so
+        logging an event costs the same whatever the length of the chain.
+
+        Args:
+            path (str): File the records are written to
+            node_id (int): Node id stamped on every record
+            buffer_size (int, optional): Records held before a write.
+                Defaults to 256.
+            flush_interval (float, optional): Seconds after which buffered
+                records are written anyway. Defaults to 1.0.
+            clock (callable, optional): Returns the current time in seconds.
+            append (bool, optional): Continue the records of an existing
+                file instead of truncating it. Defaults to False.
+        """
+        self.node_id = node_id
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.file = open(path, 'a' if append else 'w')
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+
+        self.buffer = []
+        self.last_flush = clock()
+
+    def record(self, event, **fields):
+        """Log an event
+
+        Args:
+            event (str): TX_SENT/TX_RECEIVED/BLOCK_MINED/BLOCK_ACCEPTED/
+                FORK/TIP/REORG/SNAPSHOT
+            **fields: JSON serializable details of the event
+        """
+        now = self.clock()
+        fields['time'] = now
+        fields['node'] = self.node_id
+        fields['event'] = event
+        self.buffer.append(self.encoder.encode(fields))
+
+        if len(self.buffer) >= self.buffer_size or \
+                now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.file.write('\n'.join(self.buffer))
+            self.file.flush()
+            self.buffer = []
+        self.last_flush = self.clock()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_events(path):
+    """Read the records of an event log
+
+    Args:
+        path (str)
+
+    Returns:
+        List[dict]: Records in the order they were logged
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
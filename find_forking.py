@@ -1,53 +1,313 @@
-"""Read the logs and print where a node forked"""
+"""Read the logs and print where the nodes forked"""
 # Arguments:
 #
 # 1: Number of nodes on the bitcoin network
+# 2: (Optional) Directory of the logs. Defaults to ./logs/
+# 3: (Optional) Pass --per-height to print the convergence of every height
+import os
 import sys
+import json
+import multiprocessing
 
-num_nodes = int(sys.argv[1])
-logs_dir = './logs/'
-chains = []
-max_length = 0
-
-for node in range(num_nodes):
-    node_log_file = logs_dir + 'log_' + str(node) + '.txt'
-    with open(node_log_file) as f:
-        content = f.readlines()
-    content = [x.strip() for x in content]
-    rev_content = content[::-1]
-    rev_index = rev_content.index('Chain:')
-
-    curr_index = len(content) - rev_index
-    blk_hash = content[curr_index]
-    final_chain = [blk_hash]
-
-    while blk_hash.endswith(','):
-        curr_index += 1
-        blk_hash = content[curr_index]
-        final_chain.append(blk_hash)
-
-    final_chain = final_chain[::-1]
-    print('Chain length for node ' + str(node) + ': ' + str(len(final_chain)))
-    max_length = max(max_length, len(final_chain))
-    chains.append(final_chain)
-
-# Generate the printing chains
-print_chains = []
-for index in range(max_length):
-    print_chains.append([])
-    for node in range(num_nodes):
-        if (len(chains[node]) > index):
-            print_chains[index].append(chains[node][index][:7])
-        else:
-            print_chains[index].append('')
-
-# Print the forking chains
-for index in range(max_length):
-    hash_set = set(print_chains[index])
-    indices_set = []
-    for ele in hash_set:
-        indices = [str(i) for i, x in enumerate(print_chains[index]) if x == ele]
-        indices_set.append(indices)
-    
-    print('\t\t'.join([','.join(_indices) for _indices in indices_set]))
-    print('\t\t'.join(hash_set))
\ No newline at end of file
+
+class BlockDag:
+    def __init__(self):
+        """Blocks seen by any of the nodes, merged from their event logs"""
+        # Parents format - hash: parent hash, None for the genesis block
+        self.parents = {}
+        # Heights format - hash: height
+        self.heights = {}
+        # First seen format - hash: earliest time a node logged the block
+        self.first_seen = {}
+        # Work format - hash: cumulative work of the tips logged
+        self.work = {}
+        # Final tip of each node
+        self.tips = {}
+        # Tip history format - node: [(time, tip hash)]
+        self.tip_history = {}
+        self.received = 0
+        self.received_orphans = 0
+        # Depth of every switch of a node to another branch
+        self.reorg_depths = []
+        # Main chain of each node at its last snapshot, genesis first
+        self.chains = {}
+
+    def add_block(self, block_hash, parent, height, seen=None):
+        if parent is not None or block_hash not in self.parents:
+            self.parents[block_hash] = parent
+        if height >= 0:
+            self.heights[block_hash] = height
+        if seen is not None and seen < self.first_seen.get(
+                block_hash, float('inf')):
+            self.first_seen[block_hash] = seen
+
+    def add_event(self, event):
+        """Merge one record of an event log
+
+        Args:
+            event (dict)
+        """
+        kind = event['event']
+        node = event['node']
+        if kind == 'BLOCK_ACCEPTED':
+            self.add_block(event['hash'], event['prev'], event['height'],
+                           event['time'])
+            self.received += 1
+            self.received_orphans += event['height'] < 0
+        elif kind == 'BLOCK_MINED':
+            self.add_block(event['hash'], event['prev'], -1, event['time'])
+        elif kind == 'TIP':
+            self.tip_history.setdefault(node, []).append(
+                (event['time'], event['hash']))
+            self.tips[node] = event['hash']
+            self.work[event['hash']] = event.get('work', -1)
+        elif kind == 'REORG':
+            self.reorg_depths.append(event['depth'])
+        elif kind == 'SNAPSHOT':
+            # The chain is rebuilt from the blocks connected since the
+            # previous snapshot
+            chain = self.chains.setdefault(node, [])
+            del chain[event['fork'] + 1:]
+            for block_hash in event['added']:
+                self.add_block(block_hash, chain[-1] if chain else None,
+                               len(chain))
+                chain.append(block_hash)
+            history = self.tip_history.setdefault(node, [])
+            if not history or history[-1][1] != event['tip']:
+                history.append((event['time'], event['tip']))
+            self.tips[node] = event['tip']
+            self.work[event['tip']] = event.get('work', -1)
+
+    def fill_heights(self):
+        """Derive the heights of blocks only seen as orphans or mined"""
+        for block_hash in list(self.parents):
+            path = []
+            curr = block_hash
+            while curr not in self.heights and curr in self.parents:
+                path.append(curr)
+                curr = self.parents[curr]
+            if curr in self.heights:
+                height = self.heights[curr]
+                for ancestor in reversed(path):
+                    height += 1
+                    self.heights[ancestor] = height
+
+    def merge(self, other):
+        """Merge the DAG read from the log of another node
+
+        Args:
+            other (BlockDag)
+        """
+        for block_hash, parent in other.parents.items():
+            self.add_block(block_hash, parent,
+                           other.heights.get(block_hash, -1),
+                           other.first_seen.get(block_hash))
+        self.work.update(other.work)
+        self.tips.update(other.tips)
+        self.tip_history.update(other.tip_history)
+        self.received += other.received
+        self.received_orphans += other.received_orphans
+        self.reorg_depths.extend(other.reorg_depths)
+
+    def chain(self, tip):
+        """Hashes of the chain ending at `tip`, genesis first"""
+        chain = []
+        while tip is not None:
+            chain.append(tip)
+            tip = self.parents.get(tip)
+        return chain[::-1]
+
+
+def read_log(path):
+    """Read the event log of a node into a block DAG, one record at a time
+    so that memory does not grow with the length of the log. Transaction
+    records are skipped without being decoded.
+
+    Args:
+        path (str)
+
+    Returns:
+        BlockDag
+    """
+    decode = json.JSONDecoder().decode
+    dag = BlockDag()
+    with open(path) as f:
+        for line in f:
+            if line.strip() and '"event":"TX_' not in line:
+                dag.add_event(decode(line))
+    return dag
+
+
+def read_dag(num_nodes, logs_dir):
+    """Read the event logs of all nodes, in parallel if there are several
+    cores, and merge them into a single block DAG
+
+    Args:
+        num_nodes (int)
+        logs_dir (str)
+
+    Returns:
+        BlockDag
+    """
+    paths = [
+        os.path.join(logs_dir, 'log_' + str(node) + '.jsonl')
+        for node in range(num_nodes)
+    ]
+    dag = BlockDag()
+    if (os.cpu_count() or 1) > 1 and num_nodes > 1:
+        with multiprocessing.Pool() as pool:
+            for node_dag in pool.imap_unordered(read_log, paths):
+                dag.merge(node_dag)
+    else:
+        for path in paths:
+            dag.merge(read_log(path))
+    dag.fill_heights()
+    return dag
+
+
+def canonical_tip(dag):
+    """Final tip with the most work, then the highest one, then the one held
+    by the most nodes"""
+    votes = {}
+    for tip in dag.tips.values():
+        votes[tip] = votes.get(tip, 0) + 1
+    return max(votes,
+               key=lambda tip: (dag.work.get(tip, -1),
+                                dag.heights.get(tip, -1), votes[tip]))
+
+
+def find_forks(dag, canonical):
+    """Find the blocks with more than one child
+
+    Args:
+        dag (BlockDag)
+        canonical (dict): hash: height of the blocks on the canonical chain
+
+    Returns:
+        List: (height, hash, children, depth), where depth is the length of
+            the longest branch losing the fork
+    """
+    children = {}
+    for block_hash, parent in dag.parents.items():
+        if parent is not None:
+            children.setdefault(parent, []).append(block_hash)
+
+    # Length of the longest chain of descendants of each block, leaves first
+    reach = {}
+    for block_hash in sorted(dag.parents,
+                             key=lambda h: dag.heights.get(h, -1),
+                             reverse=True):
+        reach[block_hash] = 1 + max(
+            (reach.get(child, 0) for child in children.get(block_hash, [])),
+            default=0)
+
+    forks = []
+    for block_hash, kids in children.items():
+        if len(kids) < 2:
+            continue
+        # The canonical child, or else the deepest one, wins the fork
+        winner = max(kids, key=lambda h: (h in canonical, reach[h]))
+        depth = max(reach[h] for h in kids if h != winner)
+        forks.append((dag.heights.get(block_hash, -1), block_hash, len(kids),
+                      depth))
+    return sorted(forks)
+
+
+def convergence_times(dag, canonical, height):
+    """Find when each height of the canonical chain was settled on by all
+    nodes, as the time after which no node switched to a tip disagreeing
+    with the canonical chain at that height
+
+    Args:
+        dag (BlockDag)
+        canonical (dict): hash: height of the blocks on the canonical chain
+        height (int): Height of the canonical tip
+
+    Returns:
+        List[float]: Time of convergence of every height, None if the nodes
+            never agreed on it
+    """
+    settled = [0.0] * (height + 1)
+    for history in dag.tip_history.values():
+        # Height up to which the tip agrees with the canonical chain
+        agreed = []
+        for seen, tip in history:
+            while tip is not None and tip not in canonical:
+                tip = dag.parents.get(tip)
+            agreed.append(canonical[tip] if tip is not None else -1)
+
+        # Lowest agreement of every tip from each point of the history on,
+        # which only grows along the history
+        lowest = agreed[:]
+        for index in range(len(lowest) - 2, -1, -1):
+            lowest[index] = min(lowest[index], lowest[index + 1])
+
+        node_settled = []
+        index = 0
+        for h in range(height + 1):
+            while index < len(history) and lowest[index] < h:
+                index += 1
+            node_settled.append(
+                history[index][0] if index < len(history) else None)
+        for h in range(height + 1):
+            if node_settled[h] is None or settled[h] is None:
+                settled[h] = None
+            else:
+                settled[h] = max(settled[h], node_settled[h])
+    return settled
+
+
+if __name__ == '__main__':
+    num_nodes = int(sys.argv[1])
+    logs_dir = sys.argv[2] if len(sys.argv) > 2 else './logs/'
+    per_height = '--per-height' in sys.argv[3:]
+
+    dag = read_dag(num_nodes, logs_dir)
+    tip = canonical_tip(dag)
+    chain = dag.chain(tip)
+    canonical = {block_hash: height for height, block_hash in enumerate(chain)}
+    height = len(chain) - 1
+
+    agreeing = sorted(node for node, node_tip in dag.tips.items()
+                      if node_tip == tip)
+    print('Blocks: ' + str(len(dag.parents)) + ', canonical height: ' +
+          str(height) + ', tip: ' + tip)
+    print('Nodes on the canonical tip: ' + str(len(agreeing)) + '/' +
+          str(num_nodes))
+    for node in sorted(dag.tips):
+        if dag.tips[node] != tip:
+            print('  node ' + str(node) + ' at height ' +
+                  str(dag.heights.get(dag.tips[node], -1)) + ', tip ' +
+                  dag.tips[node])
+
+    forks = find_forks(dag, canonical)
+    print('Fork points: ' + str(len(forks)) + ', max fork depth: ' +
+          str(max((fork[3] for fork in forks), default=0)))
+    for fork_height, block_hash, kids, depth in forks:
+        print('  height ' + str(fork_height) + ': ' + block_hash + ' (' +
+              str(kids) + ' children, depth ' + str(depth) + ')')
+
+    print('Reorganizations: ' + str(len(dag.reorg_depths)) +
+          ', max depth: ' + str(max(dag.reorg_depths, default=0)))
+
+    stale = len(dag.parents) - len(chain)
+    print('Stale blocks: ' + str(stale) + '/' + str(len(dag.parents)) +
+          ' ({:.1%})'.format(stale / len(dag.parents)))
+    if dag.received:
+        print('Orphan rate: ' + str(dag.received_orphans) + '/' +
+              str(dag.received) +
+              ' received blocks arrived before their parent ({:.1%})'.format(
+                  dag.received_orphans / dag.received))
+
+    settled = convergence_times(dag, canonical, height)
+    delays = []
+    for h in range(1, height + 1):
+        block_hash = chain[h]
+        if settled[h] is not None and block_hash in dag.first_seen:
+            delays.append((settled[h] - dag.first_seen[block_hash], h))
+    if delays:
+        print('Time to convergence: mean {:.3f}s, max {:.3f}s at height {}'.
+              format(sum(d for d, _ in delays) / len(delays), *max(delays)))
+    if per_height:
+        for delay, h in delays:
+            print('  height ' + str(h) + ': {:.3f}s'.format(delay))
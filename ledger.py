@@ -0,0 +1,117 @@
+"""Account balances of the main chain, used to validate transactions"""
+
+
+class Ledger:
+    def __init__(self, init_amt, reward, account_of):
+        """Ledger Ctor
+
+        Args:
+            init_amt (int): Amount of the INIT transaction of every wallet
+            reward (int): Amount of the MINE transaction of every block
+            account_of (callable): Maps the node id of a sender to the
+                account (public key) its coins are debited from
+        """
+        self.init_amt = init_amt
+        self.reward = reward
+        self.account_of = account_of
+
+        # Balances format - account: amount
+        self.balances = {}
+        # Accounts which have received their INIT transaction
+        self.initialized = set()
+        # Digests of the transactions of the main chain, so that none is
+        # applied twice
+        self.confirmed = set()
+        # Undo logs format - block hash: [(account, delta, is_init, digest)],
+        # in the order the transactions of the block were applied. The
+        # digest is set on the entry crediting the receiver only.
+        self.undo_logs = {}
+
+    def balance(self, account):
+        return self.balances.get(account, 0)
+
+    def check(self, tx, pending=0):
+        """Validate a transaction against the current balances
+
+        Args:
+            tx (Transaction)
+            pending (int, optional): Amount the sender already spends in
+                unconfirmed transactions. Defaults to 0.
+
+        Returns:
+            boolean: True if legal else False
+        """
+        if tx.digest() in self.confirmed:
+            # Replay of a transaction already in the main chain
+            return False
+        if tx.type == 'INIT':
+            return (tx.amount == self.init_amt
+                    and tx.receiver not in self.initialized
+                    and tx.receiver == self.account_of(tx.sender))
+        if tx.type == 'MINE':
+            return (tx.amount == self.reward
+                    and tx.receiver == self.account_of(tx.sender))
+        if tx.type == 'TRANSFER':
+            sender = self.account_of(tx.sender)
+            return 0 < tx.amount <= self.balance(sender) - pending
+        return False
+
+    def __credit(self, account, delta, is_init, log, digest=None):
+        balance = self.balances.get(account, 0) + delta
+        if balance:
+            self.balances[account] = balance
+        else:
+            self.balances.pop(account, None)
+        if is_init:
+            self.initialized.add(account)
+        if digest is not None:
+            self.confirmed.add(digest)
+        log.append((account, delta, is_init, digest))
+
+    def __revert(self, log):
+        for account, delta, is_init, digest in reversed(log):
+            balance = self.balances.get(account, 0) - delta
+            if balance:
+                self.balances[account] = balance
+            else:
+                self.balances.pop(account, None)
+            if is_init:
+                self.initialized.discard(account)
+            if digest is not None:
+                self.confirmed.discard(digest)
+
+    def apply_block(self, block_hash, transactions):
+        """Apply the transactions of the block extending the current state,
+        keeping an undo log to roll it back on a reorganization
+
+        Args:
+            block_hash (str)
+            transactions (List[Transaction])
+
+        Returns:
+            boolean: False if some transaction is illegal or appears twice,
+                in which case the state is left unchanged
+        """
+        log = []
+        mined = 0
+        for tx in transactions:
+            mined += tx.type == 'MINE'
+            if mined > 1 or not self.check(tx):
+                self.__revert(log)
+                return False
+            if tx.type == 'TRANSFER':
+                self.__credit(self.account_of(tx.sender), -tx.amount, False,
+                              log)
+            self.__credit(tx.receiver, tx.amount, tx.type == 'INIT', log,
+                          tx.digest())
+
+        self.undo_logs[block_hash] = log
+        return True
+
+    def rollback_block(self, block_hash):
+        """Undo the block applied last
+
+        Args:
+            block_hash (str)
+        """
+        self.__revert(self.undo_logs.pop(block_hash))
@@ -8,11 +8,21 @@
 # 5: Number of dishonest nodes in the blockchain system
 # 6: Arity of Merkel Tree
 # 7: Difficulty of POW
+# 8: (Optional) Number of processes each miner uses for POW. Defaults to 1.
+# 9: (Optional) Directory to persist the blocks of each node in. Nodes reload
+#    their chain from it when started again. Not persisted by default.
+# 10: (Optional) Number of random peers each message is gossiped to. Messages
+#     are broadcast to every node if 0. Defaults to 0.
+# 11: (Optional) Transport between the nodes - queue/unix. Defaults to queue.
+# 12: (Optional) Seconds between blocks the difficulty is retargeted to,
+#     starting from the difficulty of argument 7. Fixed difficulty if 0.
+#     Defaults to 0.
 
 import os
 import sys
 import Crypto
 from node import Node
+from transport import SocketTransport, bind_sockets
 from Crypto.PublicKey import RSA
 from ctypes import Structure, c_wchar_p
 from multiprocessing import Process, Queue, Array
@@ -38,16 +48,52 @@ def generate_wallet():
     return private_key, public_key
 
 
+def load_wallet(store_dir, node_id):
+    """Load the key pair a node used before it was restarted, or generate
+    one saved next to its blocks. Accounts of the chain are public keys, so
+    a node restarted with a new key would lose its coins.
+
+    Args:
+        store_dir (str): Directory the blocks of the nodes are persisted in
+        node_id (int)
+
+    Returns:
+        tuple: (_RSAObj, _RSAObj) Private and public key of the node
+    """
+    path = os.path.join(store_dir, 'node_' + str(node_id) + '.pem')
+    if os.path.exists(path):
+        with open(path) as f:
+            private_key = RSA.importKey(f.read())
+        return private_key, private_key.publickey()
+
+    private_key, public_key = generate_wallet()
+    os.makedirs(store_dir, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(private_key.exportKey('PEM'))
+    return private_key, public_key
+
+
 def spawn_process(node_id, private_key, is_miner, block_size, keys, queues,
-                  is_dishonest, dishonest_master, arity, difficulty, timeout):
-    """Spawn a new Node process. Arguments same as those required by Node ctor"""
+                  is_dishonest, dishonest_master, arity, difficulty, timeout,
+                  mining_workers, store_dir, fanout, sock, paths,
+                  block_interval):
+    """Spawn a new Node process. Arguments same as those required by Node ctor,
+    along with the Unix socket of the node and the socket paths of all nodes
+    if they are connected by sockets"""
     Crypto.Random.atfork()
+    transport = None
+    if sock is not None:
+        transport = SocketTransport(node_id, sock, paths, fanout)
     if is_dishonest:
         node = Node(node_id, private_key, is_miner, block_size, keys, queues,
-                    arity, difficulty, is_dishonest, dishonest_master)
+                    arity, difficulty, is_dishonest, dishonest_master,
+                    mining_workers, store_dir=store_dir, fanout=fanout,
+                    transport=transport, block_interval=block_interval)
     else:
         node = Node(node_id, private_key, is_miner, block_size, keys, queues,
-                    arity, difficulty)
+                    arity, difficulty, mining_workers=mining_workers,
+                    store_dir=store_dir, fanout=fanout, transport=transport,
+                    block_interval=block_interval)
 
     # Start the operation of the node
     node.start_operation(timeout)
@@ -61,22 +107,35 @@ if __name__ == '__main__':
     num_dishonest = int(sys.argv[5])
     arity = int(sys.argv[6])
     difficulty = int(sys.argv[7])
+    mining_workers = int(sys.argv[8]) if len(sys.argv) > 8 else 1
+    store_dir = sys.argv[9] if len(sys.argv) > 9 and sys.argv[9] else None
+    fanout = int(sys.argv[10]) if len(sys.argv) > 10 else 0
+    transport = sys.argv[11] if len(sys.argv) > 11 else 'queue'
+    block_interval = float(sys.argv[12]) if len(sys.argv) > 12 else 0
     dishonest_master = 0 if num_dishonest > 0 else -1
 
     # Check if input is valid:
     if num_miners + num_dishonest > num_nodes:
         print('Incorrect params: num_miners + num_dishonest <= num_nodes')
 
-    # Attach a queue for each node
+    # Attach a queue or a socket for each node
     queues = []
-    for _ in range(num_nodes):
-        q = Queue()
-        queues.append(q)
+    sockets, paths = [None] * num_nodes, None
+    if transport == 'unix':
+        sockets, paths = bind_sockets('./sockets/', num_nodes)
+    else:
+        for _ in range(num_nodes):
+            q = Queue()
+            queues.append(q)
 
-    # Generate the pair of public and private keys for each of the nodes
+    # Generate the pair of public and private keys for each of the nodes,
+    # or reload those of the previous run when the blocks are persisted
     keys = []
-    for _ in range(num_nodes):
-        private_key, public_key = generate_wallet()
+    for node_id in range(num_nodes):
+        if store_dir is not None:
+            private_key, public_key = load_wallet(store_dir, node_id)
+        else:
+            private_key, public_key = generate_wallet()
         keys.append((private_key, public_key))
 
     processes = []
@@ -92,7 +151,9 @@ if __name__ == '__main__':
         p = Process(target=spawn_process,
                     args=(node_id, keys[node_id][0], is_miner, block_size,
                           public_keys, queues, is_dishonest, dishonest_master,
-                          arity, difficulty, timeout))
+                          arity, difficulty, timeout, mining_workers,
+                          store_dir, fanout, sockets[node_id], paths,
+                          block_interval or None))
         processes.append(p)
         p.start()
 
@@ -0,0 +1,171 @@
+"""Pool of unconfirmed transactions, ordered by priority for mining"""
+import heapq
+import itertools
+
+# INIT transactions go first, as the transfers of a wallet depend on them
+TYPE_RANKS = {'INIT': 0, 'TRANSFER': 1, 'MINE': 2}
+
+
+class Mempool:
+    def __init__(self, account_of, max_size=10000):
+        """Mempool Ctor
+
+        Args:
+            account_of (callable): Maps the node id of a sender to the
+                account its coins are debited from
+            max_size (int, optional): Transactions held before the lowest
+                priority ones are evicted. Defaults to 10000.
+        """
+        self.account_of = account_of
+        self.max_size = max_size
+        self.arrivals = itertools.count()
+
+        # Entries format - digest: (priority, tx), where a lower priority
+        # tuple is mined first: (type rank, -amount, arrival)
+        self.entries = {}
+        # Heaps of (priority, digest), lowest and highest priority first.
+        # Entries whose priority no longer matches the pool (removed, or
+        # removed and added again) are skipped when they reach the top.
+        self.best = []
+        self.worst = []
+        # Amount each account spends in the pool
+        self.debits = {}
+        # Receivers of the INIT transactions in the pool
+        self.init_receivers = set()
+        # Short ids format - short id: digest, to rebuild compact blocks
+        self.short_ids = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, digest):
+        return digest in self.entries
+
+    def pending_debit(self, account):
+        return self.debits.get(account, 0)
+
+    def has_init(self, receiver):
+        return receiver in self.init_receivers
+
+    def by_short_id(self, short_id):
+        """Find a pooled transaction by the short id of a compact block
+
+        Args:
+            short_id (bytes)
+
+        Returns:
+            Transaction: None if no transaction has this short id
+        """
+        entry = self.entries.get(self.short_ids.get(short_id))
+        return entry[1] if entry else None
+
+    def add(self, tx):
+        """Add a transaction, unless it is already in the pool. Evicts the
+        lowest priority transaction if the pool is full.
+
+        Args:
+            tx (Transaction)
+
+        Returns:
+            boolean: True if the transaction is in the pool afterwards
+        """
+        digest = tx.digest()
+        if digest in self.entries:
+            return False
+
+        priority = (TYPE_RANKS[tx.type], -tx.amount, next(self.arrivals))
+        self.entries[digest] = (priority, tx)
+        self.short_ids[tx.short_id()] = digest
+        heapq.heappush(self.best, (priority, digest))
+        heapq.heappush(self.worst, (tuple(-key for key in priority), digest))
+        self.__track(tx, 1)
+
+        while len(self.entries) > self.max_size:
+            self.__evict()
+        return digest in self.entries
+
+    def __track(self, tx, sign):
+        if tx.type == 'TRANSFER':
+            account = self.account_of(tx.sender)
+            debit = self.debits.get(account, 0) + sign * tx.amount
+            if debit:
+                self.debits[account] = debit
+            else:
+                del self.debits[account]
+        elif tx.type == 'INIT':
+            if sign > 0:
+                self.init_receivers.add(tx.receiver)
+            else:
+                self.init_receivers.discard(tx.receiver)
+
+    def __is_current(self, priority, digest):
+        entry = self.entries.get(digest)
+        return entry is not None and entry[0] == priority
+
+    def __evict(self):
+        while self.worst:
+            inverse, digest = heapq.heappop(self.worst)
+            if self.__is_current(tuple(-key for key in inverse), digest):
+                self.__discard(digest)
+                return
+
+    def __discard(self, digest):
+        _, tx = self.entries.pop(digest)
+        if self.short_ids.get(tx.short_id()) == digest:
+            del self.short_ids[tx.short_id()]
+        self.__track(tx, -1)
+
+    def remove(self, transactions):
+        """Remove transactions confirmed by a block
+
+        Args:
+            transactions (List[Transaction])
+        """
+        for tx in transactions:
+            digest = tx.digest()
+            if digest in self.entries:
+                self.__discard(digest)
+
+        # Drop the removed entries once they make up most of the heaps
+        if len(self.best) > 2 * len(self.entries) + 64:
+            self.best = [(priority, digest)
+                         for digest, (priority, _) in self.entries.items()]
+            heapq.heapify(self.best)
+            self.worst = [(tuple(-key for key in priority), digest)
+                          for priority, digest in self.best]
+            heapq.heapify(self.worst)
+
+    def select(self, count, is_legal=None, exclude=()):
+        """Return the highest priority transactions, dropping those that are
+        no longer legal
+
+        Args:
+            count (int): Maximum number of transactions returned
+            is_legal (callable, optional): Called on each candidate in
+                priority order, returns False for a transaction to drop
+            exclude (set, optional): Digests of transactions passed over,
+                such as those already selected. Defaults to ().
+
+        Returns:
+            List[Transaction]: In priority order
+        """
+        selected = []
+        popped = []
+        while self.best and len(selected) < count:
+            entry = heapq.heappop(self.best)
+            priority, digest = entry
+            if not self.__is_current(priority, digest):
+                continue
+            if digest in exclude:
+                popped.append(entry)
+                continue
+            tx = self.entries[digest][1]
+            if is_legal is not None and not is_legal(tx):
+                self.__discard(digest)
+                continue
+            popped.append(entry)
+            selected.append(tx)
+
+        for entry in popped:
+            heapq.heappush(self.best, entry)
+        return selected
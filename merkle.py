@@ -1,82 +1,197 @@
 """Implement Merkle Trees to be used for blockchain protocol"""
-import json
-from Crypto.Hash import SHA
+import hashlib
+
+
+def hash_level(level, arity):
+    """Compute the parent level of a level of digests
+
+    Args:
+        level (List[bytes]): Digests of the current level
+        arity (int): Arity of the Merkle Tree
+
+    Returns:
+        List[bytes]: Digests of the next level
+    """
+    sha1 = hashlib.sha1
+    join = b''.join
+    last = len(level)
+    next_level = []
+    for index in range(0, last, arity):
+        group = level[index:index + arity]
+        if len(group) < arity:
+            # Duplicate last node if a child doesn't exist
+            group.extend([level[-1]] * (arity - len(group)))
+        next_level.append(sha1(join(group)).digest())
+    return next_level
+
+
+def verify_proof(tx, proof, merkle_root, arity):
+    """Check that a transaction is included in a block, given only its
+    inclusion proof and the merkle root from the block header
+
+    Args:
+        tx (Transaction)
+        proof (List): Inclusion proof returned by MerkleTree.get_proof
+        merkle_root (str): Merkle root of the block header
+        arity (int): Arity of the Merkle Tree of the block
+
+    Returns:
+        boolean: True if the proof leads to `merkle_root`
+    """
+    digest = tx.digest()
+    for position, siblings in proof:
+        if len(siblings) != arity - 1 or not 0 <= position < arity:
+            return False
+        group = siblings[:position] + [digest] + siblings[position:]
+        digest = hashlib.sha1(b''.join(group)).digest()
+    return digest.hex() == merkle_root
+
+
+def compute_root(transactions, arity):
+    """Compute the merkle root without keeping the levels of the tree
+
+    Args:
+        transactions (List[Transaction]): Transactions in Merkle Tree
+        arity (int): Arity of the Merkle Tree
+
+    Returns:
+        str: Hex digest of the Merkle root, '' if there are no transactions
+    """
+    if arity < 2:
+        raise ValueError('Merkle Tree arity must be at least 2')
+    curr_level = [t.digest() for t in transactions]
+    while len(curr_level) > 1:
+        curr_level = hash_level(curr_level, arity)
+    return curr_level[0].hex() if curr_level else ''
 
 
-class MerkleNode:
-    """A single node in a Merkle tree of given arity"""
+class MerkleTree:
     def __init__(self, arity):
-        """MerkleNode Ctor
+        """MerkleTree Ctor
 
         Args:
             arity (int): Arity of the Merkle Tree
         """
-        self.parent = None
-        self.children = [None] * arity
-        self.value = ''
+        self.arity = arity
+        # Levels format - [leaf digests, ..., [root digest]]
+        self.levels = []
+        self.root = ''
 
-    def set_value(self, value):
-        self.value = value
+    def construct_tree(self, transactions):
+        """Construct the non-leaf levels and set the root
 
-    def set_parent(self, parent):
-        self.parent = parent
+        Args:
+            transactions (List[Transaction]): Transactions in Merkle Tree
+        """
+        if self.arity < 2:
+            raise ValueError('Merkle Tree arity must be at least 2')
+
+        curr_level = [t.digest() for t in transactions]
+        self.levels = [curr_level]
 
-    def set_child(self, index, child):
-        self.children[index] = child
+        # Create non-leaf levels
+        while len(curr_level) > 1:
+            curr_level = hash_level(curr_level, self.arity)
+            self.levels.append(curr_level)
 
-    def compute_value(self):
-        """Compute and set the hash of the current instance"""
-        combined = ''.join([child.value for child in self.children])
-        c_digest = SHA.new(combined.encode('utf-8')).hexdigest()
-        self.value = c_digest
-        return self.value
+        # Set the Merkle Root
+        self.root = curr_level[0].hex() if curr_level else ''
 
+    def get_proof(self, index):
+        """Create the inclusion proof of the transaction at `index`
 
-class MerkleTree:
+        Args:
+            index (int): Position of the transaction in the block
+
+        Returns:
+            List: (position, siblings) for each level from the leaves up,
+                where siblings are the raw digests sharing the parent with
+                the node at `position` of its group
+        """
+        num_leaves = len(self.levels[0]) if self.levels else 0
+        if not 0 <= index < num_leaves:
+            raise IndexError('Transaction index out of range')
+
+        proof = []
+        for level in self.levels[:-1]:
+            start = index - index % self.arity
+            group = level[start:start + self.arity]
+            if len(group) < self.arity:
+                group.extend([level[-1]] * (self.arity - len(group)))
+            position = index - start
+            proof.append((position, group[:position] + group[position + 1:]))
+            index //= self.arity
+        return proof
+
+
+class MerkleAccumulator:
+    """Append-only Merkle Tree that only keeps the frontier of incomplete
+    groups, giving the same root as MerkleTree over the same transactions"""
     def __init__(self, arity):
-        """MerkleTree Ctor
+        """MerkleAccumulator Ctor
 
         Args:
             arity (int): Arity of the Merkle Tree
         """
+        if arity < 2:
+            raise ValueError('Merkle Tree arity must be at least 2')
         self.arity = arity
-        self.root = MerkleNode(arity)
+        self.count = 0
+        # Frontier format - [digests of the incomplete group at each level]
+        self.frontier = []
 
-    def construct_tree(self, transactions):
-        """Construct the non-leaf nodes and set the root
+    def append(self, tx):
+        """Add a transaction as the next leaf
 
         Args:
-            transactions (List): List of JSON of transactions in Merkle Tree
+            tx (Transaction)
         """
-        curr_level = []
-
-        for t in transactions:
-            node = MerkleNode(self.arity)
-            t_string = json.dumps(transactions, sort_keys=True)
-            t_digest = SHA.new(t_string.encode('utf-8')).hexdigest()
-            node.set_value(t_digest)
-            curr_level.append(node)
-
-        # Create non-leaf nodes
-        while len(curr_level) != 1:
-            next_level = []
-
-            index = 0
-            while index < len(curr_level):
-                new_node = MerkleNode(self.arity)
-                for _in in range(self.arity):
-                    # Duplicate last node if a child doesn't exist
-                    if index + _in >= len(curr_level):
-                        new_node.set_child(_in, curr_level[-1])
-                    else:
-                        new_node.set_child(_in, curr_level[index + _in])
-                        curr_level[index + _in].set_parent(new_node)
-                new_node.compute_value()
-
-                next_level.append(new_node)
-                index += self.arity
-
-            curr_level = next_level
+        digest = tx.digest()
+        self.count += 1
+        level = 0
+        while True:
+            if level == len(self.frontier):
+                self.frontier.append([])
+            group = self.frontier[level]
+            group.append(digest)
+            if len(group) < self.arity:
+                break
+            # Group is complete, carry its hash to the next level
+            digest = hashlib.sha1(b''.join(group)).digest()
+            self.frontier[level] = []
+            level += 1
+
+    def root_with(self, tx=None):
+        """Compute the root as if `tx` were appended, without appending it
 
-        # Set the Merkle Root
-        self.root = curr_level[0]
+        Args:
+            tx (Transaction, optional): Extra last transaction
+
+        Returns:
+            str: Hex digest of the Merkle root, '' if there are no leaves
+        """
+        carry = tx.digest() if tx is not None else None
+        count = self.count + (1 if carry is not None else 0)
+        if count == 0:
+            return ''
+
+        level = 0
+        width = count
+        while width > 1:
+            group = self.frontier[level] if level < len(self.frontier) else []
+            if carry is not None:
+                group = group + [carry]
+            if group:
+                # Duplicate last node if a child doesn't exist
+                group = group + [group[-1]] * (self.arity - len(group))
+                carry = hashlib.sha1(b''.join(group)).digest()
+            width = -(-width // self.arity)
+            level += 1
+
+        if carry is None:
+            carry = self.frontier[level][0]
+        return carry.hex()
+
+    @property
+    def root(self):
+        return self.root_with()
@@ -0,0 +1,207 @@
+"""Proof of work engines used by the miner nodes"""
+import queue
+import hashlib
+import multiprocessing
+
+# Nonces are searched in [0, MAX_NONCE)
+MAX_NONCE = 2**32
+
+# Set in each worker of the ParallelMiner pool to stop the search
+_stop_event = None
+
+
+def pow_target(difficulty):
+    """Compute the target a block hash must not exceed
+
+    Args:
+        difficulty (int): Number of leading zero bits required in the hash
+
+    Returns:
+        bytes: Target as a 20-byte big-endian integer
+    """
+    target = min(2**(160 - difficulty), 2**160 - 1)
+    return target.to_bytes(20, 'big')
+
+
+def compact_target(target):
+    """Encode a target in the 4 bytes of a block header, as a 1-byte length
+    and a 3-byte mantissa. Precision below the mantissa is rounded down.
+
+    Args:
+        target (int)
+
+    Returns:
+        int: Compact target, or bits
+    """
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        mantissa = target << 8 * (3 - size)
+    else:
+        mantissa = target >> 8 * (size - 3)
+    # Keep the top bit of the mantissa clear, as in Bitcoin
+    if mantissa & 0x800000:
+        mantissa >>= 8
+        size += 1
+    return size << 24 | mantissa
+
+
+def expand_target(bits):
+    """Inverse of compact_target
+
+    Args:
+        bits (int)
+
+    Returns:
+        bytes: Target as a 20-byte big-endian integer, None if it does not
+            fit in 20 bytes
+    """
+    size, mantissa = bits >> 24, bits & 0x7fffff
+    if size <= 3:
+        target = mantissa >> 8 * (3 - size)
+    else:
+        target = mantissa << 8 * (size - 3)
+    if target >= 2**160:
+        return None
+    return target.to_bytes(20, 'big')
+
+
+def search_nonce(prefix, target, start, stop, step=1, batch_size=4096,
+                 stop_event=None):
+    """Search nonces for a hash of `prefix` + nonce that meets the target
+
+    Args:
+        prefix (bytes): Constant part of the block header
+        target (bytes): Target returned by pow_target
+        start (int): First batch starts at this nonce
+        stop (int): Nonces at or above this value are not searched
+        step (int, optional): Number of batches to skip after each batch,
+            used to interleave workers. Defaults to 1.
+        batch_size (int, optional): Nonces searched between checks of
+            `stop_event`. Defaults to 4096.
+        stop_event (Event, optional): Search is abandoned once it is set
+
+    Returns:
+        int: Nonce found, None if there was none or the search was stopped
+    """
+    # Hash the constant prefix once and copy the state for every nonce
+    state = hashlib.sha1(prefix)
+    batch_start = start
+    while batch_start < stop:
+        if stop_event is not None and stop_event.is_set():
+            return None
+        for nonce in range(batch_start, min(batch_start + batch_size, stop)):
+            candidate = state.copy()
+            candidate.update(b'%d' % nonce)
+            if candidate.digest() <= target:
+                return nonce
+        batch_start += step * batch_size
+    return None
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search_worker(prefix, target, worker, num_workers, batch_size):
+    return search_nonce(prefix, target, worker * batch_size, MAX_NONCE,
+                        num_workers, batch_size, _stop_event)
+
+
+class SerialMiner:
+    """Search the nonce space in the calling process"""
+    def __init__(self, batch_size=4096):
+        """SerialMiner Ctor
+
+        Args:
+            batch_size (int, optional): Nonces searched between checks for
+                cancellation. Defaults to 4096.
+        """
+        self.batch_size = batch_size
+
+    def mine(self, prefix, target, cancel=None):
+        """Find a nonce for the block header
+
+        Args:
+            prefix (bytes): Constant part of the block header
+            target (bytes): Target returned by pow_target
+            cancel (threading.Event, optional): Search is abandoned once set
+
+        Returns:
+            int: Nonce found, None if the nonce space was exhausted or the
+                search was cancelled
+        """
+        return search_nonce(prefix, target, 0, MAX_NONCE, 1, self.batch_size,
+                            cancel)
+
+    def close(self):
+        pass
+
+
+class ParallelMiner:
+    """Split the nonce space across a pool of worker processes"""
+    def __init__(self, num_workers=None, batch_size=4096):
+        """ParallelMiner Ctor
+
+        Args:
+            num_workers (int, optional): Number of worker processes.
+                Defaults to the number of CPUs.
+            batch_size (int, optional): Consecutive nonces handed to a worker
+                at a time. Defaults to 4096.
+        """
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.stop_event = multiprocessing.Event()
+        self.pool = None
+
+    def mine(self, prefix, target, cancel=None):
+        """Find a nonce for the block header, stopping all workers as soon as
+        one of them finds a solution
+
+        Args:
+            prefix (bytes): Constant part of the block header
+            target (bytes): Target returned by pow_target
+            cancel (threading.Event, optional): Search is abandoned once set
+
+        Returns:
+            int: Nonce found, None if the nonce space was exhausted or the
+                search was cancelled
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.num_workers, _init_worker,
+                                             (self.stop_event, ))
+
+        self.stop_event.clear()
+        results = queue.Queue()
+        for worker in range(self.num_workers):
+            self.pool.apply_async(
+                _search_worker,
+                (prefix, target, worker, self.num_workers, self.batch_size),
+                callback=results.put,
+                error_callback=results.put)
+
+        nonce = None
+        error = None
+        remaining = self.num_workers
+        while remaining:
+            try:
+                result = results.get(timeout=0.05)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    self.stop_event.set()
+                continue
+            remaining -= 1
+            if isinstance(result, Exception):
+                error = result
+                self.stop_event.set()
+            elif result is not None and nonce is None:
+                nonce = result
+                self.stop_event.set()
+        if nonce is None and error is not None:
+            raise error
+        return nonce
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
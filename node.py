@@ -1,16 +1,38 @@
 """Implementation to simulate the working of a node in a Blockchain network"""
 import os
-import time
 import json
-import base64
+import time
 import random
+import threading
 import Crypto
+from collections import OrderedDict
 from Crypto.Hash import SHA
-from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
-from datetime import datetime
+from datetime import datetime, timezone
 from block import *
 from blockchain import *
+from blockstore import BlockStore
+from compact import CompactBlock
+from eventlog import EventLog
+from sync import MAX_HEADERS, ChainSync
+from timers import Timers
+from transport import QueueTransport
+from miner import SerialMiner, ParallelMiner
+from verifier import Verifier
+from transaction import Transaction
+from wire import (RELAYED_MESSAGES, WireFormatException, decode_message,
+                  encode_message)
+
+# Compact blocks waiting for missing transactions, and own blocks kept to
+# answer requests for them
+MAX_PENDING_BLOCKS = 64
+# Transactions of own blocks kept to rebuild competing blocks, as they are no
+# longer in the mempool
+MAX_RECENT_TXS = 4096
+# Peers asked for headers when the node starts
+SYNC_PEERS = 3
+# Bytes of blocks sent in a single BLOCKS message
+MAX_BLOCKS_BYTES = 65536
 
 debug_level = 'info'
 
@@ -39,10 +61,6 @@ class IllegalBlockException(Exception):
     pass
 
 
-class BlockWaitingException(Exception):
-    pass
-
-
 class Node:
     def __init__(self,
                  node_id,
@@ -54,7 +72,22 @@ class Node:
                  arity,
                  difficulty,
                  is_dishonest=False,
-                 dishonest_master=-1):
+                 dishonest_master=-1,
+                 mining_workers=1,
+                 max_batch=64,
+                 verify_workers=0,
+                 json_wire=False,
+                 store_dir=None,
+                 snapshot_interval=5.0,
+                 fanout=0,
+                 transport=None,
+                 tx_interval=1.0,
+                 sync_interval=5.0,
+                 block_interval=None,
+                 clock=time.time,
+                 verifier=None,
+                 hash_rate=None,
+                 log_dir='./logs/'):
         """Node Ctor
 
         Args:
@@ -66,6 +99,21 @@ class Node:
             queues (List): List of Queues for each node on the network
             is_dishonest (bool, optional): If the node colludes with the dishonest master. Defaults to False.
             dishonest_master (int, optional): Node Id of the dishonest master. Defaults to -1.
+            mining_workers (int, optional): Processes used for proof of work by a miner. Defaults to 1.
+            max_batch (int, optional): Messages read from the queue and authenticated in one pass. Defaults to 64.
+            verify_workers (int, optional): Processes used to verify signatures of a batch. Defaults to 0.
+            json_wire (bool, optional): Send messages as JSON instead of the binary wire format, for debugging. Defaults to False.
+            store_dir (str, optional): Directory where the blocks of the node are persisted. The chain is reloaded from it on restart. Defaults to None.
+            snapshot_interval (float, optional): Seconds between snapshots of the state of the node in its log. Defaults to 5.0.
+            fanout (int, optional): Gossip messages to this many random peers instead of broadcasting them to every node. Defaults to 0.
+            transport (Transport, optional): Transport to use instead of the queues, such as a SocketTransport. Defaults to None.
+            tx_interval (float, optional): Seconds between the transactions generated by the node. Defaults to 1.0.
+            sync_interval (float, optional): Seconds between requests for the headers of a random peer, which recover the blocks the node missed. Defaults to 5.0.
+            block_interval (float, optional): Seconds between blocks the difficulty is retargeted to. The difficulty stays fixed if None. Defaults to None.
+            clock (callable, optional): Returns the current time in seconds, such as the virtual clock of a simulation. Defaults to time.time.
+            verifier (Verifier, optional): Verifier to share with other nodes run in the same process. Defaults to a Verifier of its own.
+            hash_rate (float, optional): Hashes per second the proof of work is simulated at, instead of running a mining thread. Nonces are then neither searched nor checked. Defaults to None.
+            log_dir (str, optional): Directory of the event log. Defaults to './logs/'.
         """
         self.id = node_id
         self.private_key = private_key
@@ -74,19 +122,75 @@ class Node:
         self.dishonest_master = dishonest_master
         self.keys = keys
         self.queues = queues
-        self.next_block = None  # Latest mined block
-        self.bc = Blockchain(block_size, arity, difficulty)
+        if transport is None:
+            transport = QueueTransport(node_id, queues, fanout)
+        self.transport = transport
+        self.max_batch = max_batch
+        self.tx_interval = tx_interval
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.json_wire = json_wire
+        self.clock = clock
+        # Shared by message authentication and block validation
+        self.verifier = verifier or Verifier(keys, verify_workers)
+        # Partial blocks format - hash: (CompactBlock, transactions with None
+        # where missing, block signature, author)
+        self.partial_blocks = OrderedDict()
+        # Mined blocks format - hash: digitally signed block
+        self.mined_blocks = OrderedDict()
+        # Recent transactions format - short id: Transaction
+        self.recent_txs = OrderedDict()
+        self.compact_stats = {
+            'received': 0,
+            'rebuilt_locally': 0,
+            'requested_txs': 0,
+            'full_blocks': 0
+        }
+        # Download of the blocks missed by the node
+        self.sync = ChainSync(clock=clock)
+        self.sync_stats = {'headers': 0, 'blocks': 0, 'served_blocks': 0}
+        # Background proof of work on the current block template
+        self.mining_thread = None
+        self.mining_cancel = None
+        self.mining_result = None
+        # Simulated proof of work, as a timer firing when the block is found
+        self.hash_rate = hash_rate
+        self.mining_timer = None
+        if is_miner and mining_workers > 1:
+            miner = ParallelMiner(mining_workers)
+        else:
+            miner = SerialMiner()
+        self.store = None
+        if store_dir is not None:
+            self.store = BlockStore(
+                os.path.join(store_dir, 'node_' + str(node_id)))
+        restarted = self.store is not None and bool(self.store.records)
+        self.bc = Blockchain(block_size,
+                             arity,
+                             difficulty,
+                             miner,
+                             self.verifier,
+                             self.store,
+                             block_interval,
+                             clock,
+                             check_pow=hash_rate is None)
+        self.bc.reorg_listeners.append(self.__log_reorg)
         print_level('basic', self.id, 'Dishonest: ' + str(self.is_dishonest))
 
-        # Initialize log file
-        log_dir = './logs/'
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        log_file = log_dir + 'log_' + str(self.id) + '.txt'
-        self.logfile = open(log_file, 'w')
-
+        # Initialize log file, continued when the node restarts from its
+        # store
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = os.path.join(log_dir, 'log_' + str(self.id) + '.jsonl')
+        self.events = EventLog(log_file,
+                               self.id,
+                               clock=clock,
+                               append=restarted)
+
+        # Main chain tip at the last snapshot, which only logs the blocks
+        # connected since
+        self.snapshot_tip = None
         # Log Initial state
-        self.__log('STATE', message='Initial State:')
+        self.__snapshot()
 
     def __get_key(self, node_id):
         """Get the public key associated with node `node_id`
@@ -101,65 +205,119 @@ class Node:
         return key_str
 
     def __node_stub(self, message, payload):
-        """Stub process to send broadcast message to all nodes
+        """Stub process to send broadcast message to all nodes. Blocks are
+        announced as compact blocks, and only the miner adds the full block.
 
         Args:
             message (str): 'TRANSACTION/BLOCK'
-            payload (str): JSON dump of the transaction or the block
+            payload (dict): Digitally signed transaction or block
         """
-        obj = {'sender': self.id, 'message': message, 'pl': payload}
-        print_level('debug', self.id, 'Broadcasting: ' + payload)
+        data = encode_message(self.id, message, payload, self.json_wire)
+        print_level('debug', self.id, 'Broadcasting ' + message)
         if message == 'TRANSACTION':
             # Log the generated transaction
-            self.__log('TRANSACTION', 'Broadcasting transaction:', payload)
+            self.__log_transaction('TX_SENT', payload['tx'])
+            self.transport.broadcast(data)
+            return
+
+        blk = payload['blk']
+        self.events.record('BLOCK_MINED',
+                           hash=blk.get_hash(),
+                           prev=blk.prev_hash,
+                           txs=len(blk.transactions))
+        self.mined_blocks[blk.get_hash()] = payload
+        if len(self.mined_blocks) > MAX_PENDING_BLOCKS:
+            self.mined_blocks.popitem(last=False)
+        for tx in blk.transactions:
+            self.recent_txs[tx.short_id()] = tx
+        while len(self.recent_txs) > MAX_RECENT_TXS:
+            self.recent_txs.popitem(last=False)
+
+        self.transport.deliver(data)
+        compact = {
+            "cmpct": CompactBlock.from_block(blk),
+            "signature": payload['signature']
+        }
+        self.transport.broadcast(
+            encode_message(self.id, 'CMPCTBLOCK', compact, self.json_wire),
+            loopback=False)
 
-        for q in self.queues:
-            q.put(obj)
+    def __send_to(self, node_id, message, payload):
+        """Send a message to a single node
+
+        Args:
+            node_id (int)
+            message (str): BLOCK/GETBLOCKTXN/BLOCKTXN/GETDATA
+            payload (dict)
+        """
+        print_level('debug', self.id,
+                    'Sending ' + message + ' to ' + str(node_id))
+        self.transport.send(
+            node_id, encode_message(self.id, message, payload,
+                                    self.json_wire))
 
     def __sign(self, message, pl):
         """Digitally sign the transaction with private key
 
         Args:
             message (str): TRANSACTION/BLOCK
-            pl (dict): Python dict of the payload
+            pl (Transaction or Block): Payload to sign
 
         Returns:
-            str: JSON dump of digitally signed transaction
+            dict: Digitally signed transaction or block
         """
-        # Perform a two step hashing and signing procedure
-        pl_string = json.dumps(pl, sort_keys=True)
-        pl_digest = SHA.new(pl_string.encode('utf-8'))
+        # Perform a two step hashing and signing procedure over the
+        # canonical bytes of the payload
+        pl_digest = SHA.new(pl.to_bytes())
 
         # Digitally sign the transaction digest with the sender's private key
         signer = PKCS1_v1_5.new(self.private_key)
         signature = signer.sign(pl_digest)
 
-        # Crypto generates Byte-string - convert into unicode string for JSON dump
-        signature_string = base64.b64encode(signature).decode('utf-8')
-
         # Return the combined transaction
         if message == 'TRANSACTION':
-            payload = {"tx": pl, "signature": signature_string}
-        else:
-            payload = {"blk": pl, "signature": signature_string}
-        return json.dumps(payload, sort_keys=True)
+            pl.signature = signature
+            return {"tx": pl, "signature": signature}
+        return {"blk": pl, "signature": signature}
 
-    def __log(self, log_type, message='', payload=''):
-        """Write message `log` onto logs of this node
+    def __log_transaction(self, event, tx, sender=None):
+        """Write a transaction event onto the log of this node
 
         Args:
-            log_type (str): STATE/TRANSACTION
-            message (str, optional): Message to print before log. Defaults to ''.
-            payload (str, optional): Transaction to log. Defaults to ''.
+            event (str): TX_SENT/TX_RECEIVED
+            tx (Transaction)
+            sender (int, optional): Node the transaction was received from
         """
-        if log_type == 'STATE':
-            # Print the state of the node
-            self.logfile.write(message + '\nSTATE:\n' + str(self.bc) + '\n\n')
+        self.events.record(event,
+                           hash=tx.digest().hex(),
+                           type=tx.type,
+                           sender=tx.sender,
+                           amount=tx.amount,
+                           source=sender)
+
+    def __snapshot(self):
+        """Write the state of the node onto its log, every
+        `snapshot_interval` seconds. The main chain is logged as the height
+        it forks from the previous snapshot at, and the blocks after that
+        point, so the first snapshot holds the whole chain."""
+        if self.snapshot_tip is None:
+            fork, added = -1, self.bc.get_main_chain()
         else:
-            self.logfile.write(
-                message + '\nTRANSACTION:\n' +
-                json.dumps(json.loads(payload), indent=2, sort_keys=True) +
-                '\n\n')
+            fork, added = self.bc.main_chain_since(self.snapshot_tip)
+        self.snapshot_tip = self.bc.main
+        self.events.record('SNAPSHOT',
+                           tip=self.bc.main,
+                           height=self.bc.get_height(),
+                           work=self.bc.get_work(),
+                           header_height=self.bc.get_header_height(),
+                           bits=self.bc.next_bits(self.bc.main),
+                           blocks=len(self.bc.index),
+                           orphans=len(self.bc.orphans),
+                           invalid=len(self.bc.invalid),
+                           mempool=len(self.bc.mempool),
+                           dropped=self.transport.dropped,
+                           fork=fork,
+                           added=added)
 
     def start_operation(self, timeout):
         """Start operation of the blockchain node and end at timeout
@@ -167,77 +325,582 @@ class Node:
         Args:
             timeout (int): Time for which the node runs (in seconds)
         """
+        self.start(timeout)
+
+        # The loop sleeps until a message arrives, the mining thread is done
+        # or the next timer is due
+        while self.running:
+            self.step(self.timers.next_timeout())
+            self.timers.run_due()
+
+        self.shutdown()
+
+    def start(self, timeout, timers=None):
+        """Set the timers of the node up and announce it to the network,
+        without entering the message loop. A simulation runs the timers and
+        calls step itself.
+
+        Args:
+            timeout (float): Time for which the node runs (in seconds)
+            timers (Timers, optional): Timers shared with other nodes.
+                Defaults to Timers of its own.
+        """
         print_level('basic', self.id, 'Operation started')
 
-        start_time = time.time()
-        curr_time = time.time()
+        self.timers = timers or Timers()
+        self.running = True
+        self.timers.call_later(timeout, self.__stop)
+        self.timers.call_every(self.tx_interval, self.__send_transaction)
+        self.timers.call_every(self.snapshot_interval, self.__snapshot)
+        self.timers.call_every(self.events.flush_interval, self.events.flush)
+        self.timers.call_every(self.sync_interval, self.__sync_tick)
 
         # Start with initial balance
-        last_transaction = start_time
         transaction = self.transaction_to_self('INIT')
         self.__node_stub('TRANSACTION', transaction)
 
-        while curr_time - start_time < timeout:
-            # Read from the queue
+        # Catch up with the chain of the network, if it started earlier
+        peers = self.transport.peers
+        for peer in random.sample(peers, min(SYNC_PEERS, len(peers))):
+            self.__request_headers(peer)
+
+    def step(self, timeout=0):
+        """Handle a batch of the messages which arrived, then collect the
+        block of a finished mining thread
+
+        Args:
+            timeout (float, optional): Seconds to wait for a message if none
+                has arrived. Defaults to 0.
+        """
+        # Read a batch from the queue and authenticate it in one pass
+        objs = self.__drain_queue(timeout)
+        self.__handle_batch([
+            obj for obj, authentic in zip(objs, self.authenticate_batch(objs))
+            if authentic
+        ])
+
+        self.__check_mining()
+
+    def shutdown(self):
+        """Stop mining, close the resources of the node and print its
+        stats"""
+        self.__cancel_mining()
+        if self.mining_thread:
+            self.mining_thread.join()
+        self.transport.close()
+        self.bc.miner.close()
+        self.verifier.close()
+        self.__snapshot()
+        self.events.close()
+        if self.store:
+            self.store.close()
+        print_level('info', self.id,
+                    'Verifier stats: ' + json.dumps(self.verifier.stats()))
+        print_level('info', self.id,
+                    'Compact block stats: ' + json.dumps(self.compact_stats))
+        print_level('info', self.id,
+                    'Sync stats: ' + json.dumps(self.sync_stats))
+        print('[INFO]: Completed execution for ' + str(self.id))
+
+    def __stop(self):
+        self.running = False
+
+    def __send_transaction(self):
+        """Generate a transaction and broadcast it, every `tx_interval`
+        seconds"""
+        print_level('debug', self.id, 'Ready to send another transaction')
+        self.__node_stub('TRANSACTION', self.generate())
+
+    def __sync_tick(self):
+        """Ask a random peer for headers every `sync_interval` seconds, and
+        request again the blocks whose request timed out. Blocks held until
+        the clock reaches their timestamp are linked once it does."""
+        tip = self.bc.main
+        if self.bc.connect_future_blocks() and self.bc.main != tip:
+            self.events.record('TIP',
+                               hash=self.bc.main,
+                               height=self.bc.get_height(),
+                               work=self.bc.get_work(),
+                               prev_tip=tip)
+            self.__cancel_mining()
+        if self.transport.peers:
+            self.__request_headers(random.choice(self.transport.peers))
+        self.__request_blocks()
+
+    def __request_headers(self, peer, locator=None):
+        """Ask a peer for the headers of its main chain after the point
+        where it forks from ours
+
+        Args:
+            peer (int)
+            locator (List[str], optional): Hashes to continue from. Defaults
+                to the locator of the main chain.
+        """
+        if peer == self.id or not self.sync.request_headers(peer):
+            return
+        self.__send_to(peer, 'GETHEADERS',
+                       {"locator": locator or self.bc.locator()})
+
+    def __request_blocks(self):
+        for peer, hashes in self.sync.next_requests():
+            self.__send_to(peer, 'GETBLOCKS', {"hashes": hashes})
+
+    def __send_headers(self, obj):
+        """Answer a request for headers
+
+        Args:
+            obj (dict): Decoded GETHEADERS message
+        """
+        headers = self.bc.headers_after(obj['pl']['locator'], MAX_HEADERS)
+        self.__send_to(obj['sender'], 'HEADERS', {"headers": headers})
+
+    def __receive_headers(self, obj):
+        """Add the headers of a peer to the header chain and download the
+        blocks missing behind them
+
+        Args:
+            obj (dict): Decoded HEADERS message
+        """
+        headers = obj['pl']['headers']
+        valid = self.bc.add_headers(headers)
+        self.sync_stats['headers'] += valid
+        self.sync.add_headers(
+            obj['sender'], headers[:valid], lambda block_hash: block_hash in
+            self.bc.index or block_hash in self.bc.orphans)
+        if valid == MAX_HEADERS:
+            # The peer has more headers after the last one
+            self.__request_headers(
+                obj['sender'], [headers[-1].get_hash()] + self.bc.locator())
+        self.__request_blocks()
+
+    def __send_blocks(self, obj):
+        """Answer a request for blocks, splitting them over several BLOCKS
+        messages if needed
+
+        Args:
+            obj (dict): Decoded GETBLOCKS message
+        """
+        blocks, size = [], 0
+        for block_hash in obj['pl']['hashes']:
+            block = self.bc.get_block(block_hash)
+            if block is None:
+                continue
+            self.sync_stats['served_blocks'] += 1
+            block_size = len(block.to_bytes())
+            if blocks and size + block_size > MAX_BLOCKS_BYTES:
+                self.__send_to(obj['sender'], 'BLOCKS', {"blocks": blocks})
+                blocks, size = [], 0
+            blocks.append(block)
+            size += block_size
+        if blocks:
+            self.__send_to(obj['sender'], 'BLOCKS', {"blocks": blocks})
+
+    def __receive_blocks(self, obj):
+        """Add the blocks downloaded from a peer
+
+        Args:
+            obj (dict): Decoded BLOCKS message
+        """
+        for block in obj['pl']['blocks']:
+            self.sync_stats['blocks'] += 1
             try:
-                obj = self.queues[self.id].get(False, timeout=1)
-                print_level('debug', self.id,
-                            'Received message from node ' + str(obj['sender']))
-                if self.authenticate(obj):
-                    if obj['message'] == 'TRANSACTION':
-                        print_level('debug', self.id, 'Received TRANSACTION')
-                        # bc.add_transaction returns if the current blockchain is ready for mining.
-                        mine_ready = self.bc.add_transaction(obj['pl'])
-                        if mine_ready and self.is_miner:
-                            if self.next_block:
-                                raise BlockWaitingException
-                            print_level('debug', self.id, 'Ready for mining')
-                            # Make the block ready for transmission
-                            self.next_block = self.mine()
-                    elif (not self.is_dishonest) or (
-                            self.is_dishonest
-                            and obj['sender'] == self.dishonest_master):
-                        # Received a mined block from another node.
-                        print_level('debug', self.id, 'Received BLOCK')
-                        result = self.bc.add_block(obj['pl'])
-                        print_level(
-                            'debug', self.id, 'Add BLOCK from ' +
-                            str(obj['sender']) + ' result: ' + str(result))
-
-                        # Log if any changes to blockchain state
-                        if result:
-                            self.next_block = None
-                            self.__log(
-                                'STATE',
-                                'Status after block added to blockchain')
-                        else:
-                            raise IllegalBlockException
-            except:
-                if self.next_block:
-                    print_level('info', self.id, 'Sending self-mined block')
-                    self.__node_stub('BLOCK', self.next_block)
-                    # Reset next_block once sent
-                    self.next_block = None
-
-            # Generate transactions at the rate of 1 per second
-            curr_time = time.time()
-            if curr_time - last_transaction > 1:
-                print_level('debug', self.id,
-                            'Ready to send another transaction')
-                transaction = self.generate()
-                last_transaction = curr_time
+                self.__add_block({"blk": block}, obj['sender'])
+            except IllegalBlockException:
+                print_level('debug', self.id, 'Dropping illegal synced block')
+        self.__request_blocks()
 
-                # Broadcast transaction
-                self.__node_stub('TRANSACTION', transaction)
+    def __drain_queue(self, timeout=0):
+        """Read the messages which have arrived at this node
+
+        Args:
+            timeout (float, optional): Seconds to wait for a message if none
+                has arrived. Defaults to 0.
 
-            curr_time = time.time()
-        while not self.queues[self.id].empty():
+        Returns:
+            List[dict]: At most `max_batch` messages, each decoded once
+        """
+        objs = []
+        for data in self.transport.poll(self.max_batch, timeout):
             try:
-                self.queues[self.id].get(timeout=0.001)
-            except:
-                pass
-        self.queues[self.id].close()
-        print('[INFO]: Completed execution for ' + str(self.id))
+                obj = decode_message(data)
+            except WireFormatException:
+                print_level('debug', self.id, 'Dropping malformed message')
+                continue
+            if not self.verifier.is_known(obj['sender']):
+                print_level('debug', self.id,
+                            'Dropping message from an unknown node')
+                continue
+            if obj['message'] in RELAYED_MESSAGES and obj['sender'] != self.id:
+                # Gossiped further only once the message is found valid
+                obj['data'] = data
+            objs.append(obj)
+        return objs
+
+    def __relay(self, obj):
+        """Gossip a valid message received from the network to more peers
+
+        Args:
+            obj (dict): Message returned by __drain_queue
+        """
+        if 'data' in obj:
+            self.transport.relay(obj['data'])
+
+    def __handle_batch(self, objs):
+        """Process authenticated messages in the order they arrived. Each run
+        of consecutive transactions is added to the blockchain in one call.
+
+        Args:
+            objs (List[dict]): Messages decoded with wire.decode_message
+        """
+        txs = []
+        for obj in objs:
+            print_level('debug', self.id,
+                        'Received message from node ' + str(obj['sender']))
+            if obj['message'] == 'TRANSACTION':
+                txs.append(obj)
+                continue
+            if txs:
+                self.__dispatch(self.__handle_transactions, txs)
+                txs = []
+            self.__dispatch(self.__handle_message, obj)
+        if txs:
+            self.__dispatch(self.__handle_transactions, txs)
+
+    def __dispatch(self, handler, arg):
+        try:
+            handler(arg)
+        except IllegalBlockException:
+            print_level('debug', self.id, 'Dropping illegal block')
+        except Exception as e:
+            # A malformed message must not stop the node
+            print_level('info', self.id,
+                        'Dropping message after error: ' + repr(e))
+
+    def __handle_transactions(self, objs):
+        """Add a run of authenticated transactions to the blockchain
+
+        Args:
+            objs (List[dict]): Decoded TRANSACTION messages
+        """
+        print_level('debug', self.id,
+                    'Received ' + str(len(objs)) + ' TRANSACTION')
+        for obj in objs:
+            self.__log_transaction('TX_RECEIVED', obj['pl']['tx'],
+                                   obj['sender'])
+        # Transactions new to the mempool are relayed once they are added
+        mempool = self.bc.mempool
+        new = [obj for obj in objs if obj['pl']['tx'].digest() not in mempool]
+        # bc.add_transactions returns if the current blockchain is ready for mining.
+        mine_ready = self.bc.add_transactions([obj['pl'] for obj in objs])
+        for obj in new:
+            if obj['pl']['tx'].digest() in mempool:
+                self.__relay(obj)
+        if not mine_ready or not self.is_miner:
+            return
+        if not self.mining_thread and not self.mining_timer:
+            print_level('debug', self.id, 'Ready for mining')
+            self.__start_mining()
+        elif self.bc.can_fill_template():
+            # Mine again on a template refreshed with the new transactions
+            self.__cancel_mining()
+
+    def __handle_message(self, obj):
+        """Process an authenticated message read from the queue
+
+        Args:
+            obj (dict): Python dict of object read from queue
+        """
+        message = obj['message']
+        if message == 'TRANSACTION':
+            self.__handle_transactions([obj])
+        elif message == 'GETBLOCKTXN':
+            self.__send_block_transactions(obj)
+        elif message == 'GETDATA':
+            payload = self.mined_blocks.get(obj['pl']['hash'])
+            if payload:
+                self.__send_to(obj['sender'], 'BLOCK', payload)
+        elif message == 'GETHEADERS':
+            self.__send_headers(obj)
+        elif message == 'GETBLOCKS':
+            self.__send_blocks(obj)
+        elif self.is_dishonest and obj['sender'] != self.dishonest_master:
+            # Dishonest nodes only follow the blocks of their master
+            return
+        elif message == 'CMPCTBLOCK':
+            self.__receive_compact_block(obj)
+        elif message == 'BLOCKTXN':
+            self.__receive_block_transactions(obj)
+        elif message == 'HEADERS':
+            self.__receive_headers(obj)
+        elif message == 'BLOCKS':
+            self.__receive_blocks(obj)
+        else:
+            # Received a mined block from another node.
+            print_level('debug', self.id, 'Received BLOCK')
+            self.__add_block(obj['pl'], obj['sender'])
+
+    def __add_block(self, payload, sender):
+        """Add a block received from another node to the blockchain. Headers
+        are requested from the sender if the block is ahead of the chain.
+
+        Args:
+            payload (dict): {"blk": Block}, signed by the miner unless
+                downloaded
+            sender (int): Node the block was received from
+        """
+        blk = payload['blk']
+        self.sync.block_received(blk.get_hash())
+        tip = self.bc.main
+        result = self.bc.add_block(payload)
+        print_level(
+            'debug', self.id,
+            'Add BLOCK from ' + str(sender) + ' result: ' + str(result))
+
+        # Log if any changes to blockchain state
+        if not result:
+            raise IllegalBlockException
+        self.__log_block(blk, sender, tip)
+        if self.bc.main != tip:
+            # Template is stale, mine on the new tip
+            self.__cancel_mining()
+        if not self.bc.has_header(blk.prev_hash) and \
+                blk.prev_hash not in self.bc.orphans:
+            # Missed the parent, and maybe more blocks before it
+            self.__request_headers(sender)
+
+    def __receive_compact_block(self, obj):
+        """Rebuild an announced block from the mempool, or request the
+        transactions missing from it
+
+        Args:
+            obj (dict): Decoded CMPCTBLOCK message
+        """
+        cmpct = obj['pl']['cmpct']
+        block_hash = cmpct.get_hash()
+        if block_hash in self.bc.index or block_hash in self.bc.orphans or \
+                block_hash in self.partial_blocks:
+            return
+        if not self.bc.validate_headers([cmpct.header]):
+            print_level('debug', self.id, 'Dropping compact block without POW')
+            return
+        self.__relay(obj)
+        self.compact_stats['received'] += 1
+
+        transactions = cmpct.fill(self.__find_transaction)
+        missing = [
+            index for index, tx in enumerate(transactions) if tx is None
+        ]
+        if not missing:
+            self.compact_stats['rebuilt_locally'] += 1
+            self.__add_compact_block(cmpct, transactions,
+                                     obj['pl']['signature'], obj['sender'])
+            return
+
+        self.partial_blocks[block_hash] = (cmpct, transactions,
+                                           obj['pl']['signature'],
+                                           obj['sender'])
+        if len(self.partial_blocks) > MAX_PENDING_BLOCKS:
+            self.partial_blocks.popitem(last=False)
+        self.compact_stats['requested_txs'] += len(missing)
+        self.__send_to(obj['sender'], 'GETBLOCKTXN', {
+            "hash": block_hash,
+            "indexes": missing
+        })
+
+    def __find_transaction(self, short_id):
+        tx = self.bc.mempool.by_short_id(short_id)
+        return tx if tx is not None else self.recent_txs.get(short_id)
+
+    def __receive_block_transactions(self, obj):
+        """Complete a partial block with the transactions its author sent
+
+        Args:
+            obj (dict): Decoded BLOCKTXN message
+        """
+        entry = self.partial_blocks.pop(obj['pl']['hash'], None)
+        if entry is None:
+            return
+        cmpct, transactions, signature, author = entry
+        txs = iter(obj['pl']['txs'])
+        for index, tx in enumerate(transactions):
+            if tx is None:
+                transactions[index] = next(txs, None)
+
+        if None in transactions:
+            self.__request_full_block(cmpct.get_hash(), author)
+        else:
+            self.__add_compact_block(cmpct, transactions, signature, author)
+
+    def __send_block_transactions(self, obj):
+        """Answer a request for transactions of a block mined by this node
+
+        Args:
+            obj (dict): Decoded GETBLOCKTXN message
+        """
+        block_hash = obj['pl']['hash']
+        payload = self.mined_blocks.get(block_hash)
+        block = payload['blk'] if payload else self.bc.get_block(block_hash)
+        if block is None:
+            return
+        txs = [
+            block.transactions[index] for index in obj['pl']['indexes']
+            if index < len(block.transactions)
+        ]
+        self.__send_to(obj['sender'], 'BLOCKTXN', {
+            "hash": block_hash,
+            "txs": txs
+        })
+
+    def __request_full_block(self, block_hash, author):
+        self.compact_stats['full_blocks'] += 1
+        self.__send_to(author, 'GETDATA', {"hash": block_hash})
+
+    def __add_compact_block(self, cmpct, transactions, signature, author):
+        """Authenticate a rebuilt block and add it like a full block
+
+        Args:
+            cmpct (CompactBlock)
+            transactions (List[Transaction]): Every transaction of the block
+            signature (bytes): Signature of the full block by its author
+            author (int): Node id of the miner
+        """
+        block = cmpct.to_block(transactions)
+        obj = {
+            "sender": author,
+            "message": 'BLOCK',
+            "pl": {
+                "blk": block,
+                "signature": signature
+            },
+            "signed": block.to_bytes()
+        }
+        if not self.authenticate(obj):
+            # A short id matched the wrong transaction of the mempool
+            self.__request_full_block(cmpct.get_hash(), author)
+            return
+        self.__handle_message(obj)
+
+    def __log_block(self, blk, sender, tip):
+        """Write the events caused by an accepted block onto the log
+
+        Args:
+            blk (Block)
+            sender (int): Node the block was received from
+            tip (str): Main chain tip before the block was added
+        """
+        block_hash = blk.get_hash()
+        # Height is -1 while the block waits for its parent, or for the clock
+        # to reach its timestamp
+        height = self.bc.get_height(block_hash)
+        self.events.record('BLOCK_ACCEPTED',
+                           hash=block_hash,
+                           prev=blk.prev_hash,
+                           height=height,
+                           source=sender)
+        if height >= 0 and blk.prev_hash != tip:
+            self.events.record('FORK',
+                               hash=block_hash,
+                               prev=blk.prev_hash,
+                               height=height,
+                               tip=tip)
+        if self.bc.main != tip:
+            self.events.record('TIP',
+                               hash=self.bc.main,
+                               height=self.bc.get_height(),
+                               work=self.bc.get_work(),
+                               prev_tip=tip)
+
+    def __log_reorg(self, ancestor, disconnected, connected):
+        """Write a switch of the main chain to another branch onto the log
+
+        Args:
+            ancestor (str): Last block shared by both branches
+            disconnected (List[str]): Blocks of the old branch, in chain order
+            connected (List[str]): Blocks of the new branch, in chain order
+        """
+        self.events.record('REORG',
+                           ancestor=ancestor,
+                           height=self.bc.get_height(ancestor),
+                           depth=len(disconnected),
+                           disconnected=disconnected,
+                           connected=connected)
+
+    def __start_mining(self):
+        """Create a block template on the current tip and search for its
+        nonce in a background thread, leaving the message loop running"""
+        reward = self.transaction_to_self('MINE')
+        block = self.bc.block_template(reward['tx'])
+
+        print_level('basic', self.id, 'Starting POW for new block')
+        self.mining_cancel = threading.Event()
+        self.mining_result = None
+        if self.hash_rate:
+            # The time to find a block is exponential with a mean of its
+            # expected work over the hash rate. No nonce is searched.
+            delay = random.expovariate(self.hash_rate /
+                                       self.bc.block_work(block.bits))
+            self.mining_timer = self.timers.call_later(
+                delay,
+                lambda cancel=self.mining_cancel: self.__mining_worker(
+                    block, cancel))
+            return
+        self.mining_thread = threading.Thread(target=self.__mining_worker,
+                                              args=(block,
+                                                    self.mining_cancel),
+                                              daemon=True)
+        self.mining_thread.start()
+
+    def __mining_worker(self, block, cancel):
+        """Body of the mining thread, or callback of the timer of simulated
+        mining
+
+        Args:
+            block (Block): Template to find the nonce for
+            cancel (threading.Event): Set when the template becomes stale
+        """
+        self.mining_result = self.bc.find_nonce(block, cancel)
+        # Wake the message loop up to collect the block
+        self.transport.wakeup()
+
+    def __cancel_mining(self):
+        """Signal the mining thread to abandon its template"""
+        if self.mining_thread:
+            self.mining_cancel.set()
+        if self.mining_timer:
+            self.mining_cancel.set()
+            self.timers.cancel(self.mining_timer)
+
+    def __mining_done(self):
+        """Whether the current template was mined or abandoned
+
+        Returns:
+            boolean: False if no template is being mined
+        """
+        if self.mining_timer:
+            return self.mining_result is not None or \
+                self.mining_cancel.is_set()
+        return self.mining_thread is not None and \
+            not self.mining_thread.is_alive()
+
+    def __check_mining(self):
+        """Collect the block of a finished mining thread and start mining
+        again if the template was abandoned or more transactions are ready"""
+        if not self.__mining_done():
+            return
+        self.mining_thread = None
+        self.mining_timer = None
+        block = self.mining_result
+        self.mining_result = None
+
+        if block and block.prev_hash == self.bc.main:
+            print_level('basic', self.id,
+                        'Found nonce. Hash: ' + block.get_hash())
+            self.bc.commit_template(block)
+            print_level('info', self.id, 'Sending self-mined block')
+            self.__node_stub('BLOCK', self.__sign('BLOCK', block))
+
+        if self.is_miner and self.bc.ready_to_mine():
+            self.__start_mining()
 
     def transaction_to_self(self, tx_type, amt=0):
         """Create a digitally signed transaction to self. Required for initial
@@ -248,7 +911,7 @@ class Node:
             amt (int, optional): Amount. Defaults to 0.
 
         Returns:
-            str: JSON dump of digitally signed transaction
+            dict: Digitally signed transaction
         """
         if tx_type == 'INIT':
             amount = self.bc.init_amt
@@ -257,14 +920,9 @@ class Node:
         else:
             amount = amt
         receiver_key = self.__get_key(self.id)
-        timestamp = datetime.now()
-        tx = {
-            "type": tx_type,
-            "sender": self.id,
-            "receiver": receiver_key,
-            "amount": amount,
-            "timestamp": str(timestamp)
-        }
+        timestamp = datetime.fromtimestamp(self.clock(), timezone.utc)
+        tx = Transaction(tx_type, self.id, receiver_key, amount,
+                         str(timestamp))
 
         return self.__sign('TRANSACTION', tx)
 
@@ -272,19 +930,14 @@ class Node:
         """Return a newly created transaction
         
         Returns:
-            str: JSON dump of digitally signed transaction
+            dict: Digitally signed transaction
         """
         receiver_id = random.randint(0, len(self.keys) - 1)
         receiver_key = self.__get_key(receiver_id)
         amount = random.randint(1, 10)
-        timestamp = datetime.now()
-        tx = {
-            "type": 'TRANSFER',
-            "sender": self.id,
-            "receiver": receiver_key,
-            "amount": amount,
-            "timestamp": str(timestamp)
-        }
+        timestamp = datetime.fromtimestamp(self.clock(), timezone.utc)
+        tx = Transaction('TRANSFER', self.id, receiver_key, amount,
+                         str(timestamp))
 
         return self.__sign('TRANSACTION', tx)
 
@@ -292,53 +945,48 @@ class Node:
         """Authenticate if the transaction/block was actually sent by the receiver
 
         Args:
-            obj (dict): Python dict of object read from queue
+            obj (dict): Message decoded with wire.decode_message
 
         Returns:
             Boolean
         """
-        sender_node = obj['sender']
-        pl_string = obj['pl']
-
-        sender_key = self.__get_key(sender_node)
-        key_obj = RSA.importKey(sender_key)
-        payload = json.loads(pl_string)
+        return self.authenticate_batch([obj])[0]
 
-        if payload['signature']:
-            if obj['message'] == 'TRANSACTION' and payload['tx']:
-                raw_payload = payload['tx']
-            elif obj['message'] == 'BLOCK' and payload['blk']:
-                raw_payload = payload['blk']
-            else:
-                return False
+    def __signer(self, obj):
+        """Node whose signature a message must carry. A transaction is signed
+        by the node its coins are debited from, whichever node sent it.
 
-            # Authenticate that the transaction was actually made by the sender
-            signature = base64.b64decode(payload['signature'])
-            rt_string = json.dumps(raw_payload, sort_keys=True)
-            rt_digest = SHA.new(rt_string.encode('utf-8'))
+        Args:
+            obj (dict): Message decoded with wire.decode_message
 
-            verifier = PKCS1_v1_5.new(key_obj)
-            if verifier.verify(rt_digest, signature):
-                print_level('debug', self.id, 'Message authenticated')
-                return True
+        Returns:
+            int
+        """
+        if obj['message'] == 'TRANSACTION':
+            return obj['pl']['tx'].sender
+        return obj['sender']
 
-        # Neither is the object an authentic block nor a transaction
-        print_level('debug', self.id, 'Message unauthenticated')
-        return False
+    def authenticate_batch(self, objs):
+        """Authenticate many messages read from the queue in one pass
 
-    def mine(self):
-        """Mine the transactions accumulated until now. Called by Miner nodes.
+        Args:
+            objs (List[dict]): Messages decoded with wire.decode_message
 
         Returns:
-            str: JSON dump of digitally signed block
+            List[Boolean]
         """
-        # Generate a transaction to self as a reward for mining
-        tx_json = json.loads(self.transaction_to_self('MINE'))['tx']
-
-        print_level('basic', self.id, 'Starting POW for new block')
-        next_block = self.bc.proof_of_work(tx_json)
-
-        print_level('basic', self.id,
-                    'Found nonce. Hash: ' + next_block.get_hash())
-        block_json = next_block.to_json()
-        return self.__sign('BLOCK', block_json)
\ No newline at end of file
+        # Authenticate that the messages were actually made by the senders.
+        # Unsigned messages are authenticated with the block they rebuild.
+        items = [(self.__signer(obj), obj['signed'], obj['pl']['signature'])
+                 for obj in objs if obj['signed'] is not None]
+        verified = iter(self.verifier.verify_batch(items))
+        results = [
+            next(verified) if obj['signed'] is not None else True
+            for obj in objs
+        ]
+
+        for valid in results:
+            print_level(
+                'debug', self.id,
+                'Message authenticated' if valid else 'Message unauthenticated')
+        return results
@@ -0,0 +1,90 @@
+"""Pool of blocks whose parent has not been received yet"""
+import time
+from collections import OrderedDict
+
+
+class OrphanPool:
+    def __init__(self, max_size=256, max_age=600, clock=time.time):
+        """OrphanPool Ctor
+
+        Args:
+            max_size (int, optional): Maximum orphans held before the least
+                recently used ones are evicted. Defaults to 256.
+            max_age (int, optional): Seconds after which an orphan is
+                dropped. Defaults to 600.
+            clock (callable, optional): Returns the current time in seconds.
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+
+        # Pool format - hash: (block, time_added), least recently used first
+        self.blocks = OrderedDict()
+        # Children format - missing parent hash: {hash: None}, in the order
+        # the orphans arrived, so that they are linked in that order
+        self.children = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def __remove(self, block_hash):
+        block, _ = self.blocks.pop(block_hash)
+        siblings = self.children[block.prev_hash]
+        del siblings[block_hash]
+        if not siblings:
+            del self.children[block.prev_hash]
+        return block
+
+    def add(self, block):
+        """Add a block whose parent is unknown, evicting old orphans if the
+        pool is full
+
+        Args:
+            block (Block)
+        """
+        block_hash = block.get_hash()
+        now = self.clock()
+        if block_hash in self.blocks:
+            self.blocks.move_to_end(block_hash)
+            self.blocks[block_hash] = (block, now)
+            return
+
+        self.blocks[block_hash] = (block, now)
+        self.children.setdefault(block.prev_hash, {})[block_hash] = None
+        self.expire(now)
+        while len(self.blocks) > self.max_size:
+            self.__remove(next(iter(self.blocks)))
+
+    def expire(self, now=None):
+        """Drop orphans older than `max_age`
+
+        Args:
+            now (float, optional): Current time. Defaults to clock().
+        """
+        if now is None:
+            now = self.clock()
+        # Entries are kept in order of the time they were last added
+        while self.blocks:
+            block_hash, (_, added) = next(iter(self.blocks.items()))
+            if now - added <= self.max_age:
+                break
+            self.__remove(block_hash)
+
+    def pop_children(self, parent_hash):
+        """Remove and return the orphans waiting on `parent_hash`
+
+        Args:
+            parent_hash (str)
+
+        Returns:
+            List: Blocks whose prev_hash is `parent_hash`
+        """
+        if parent_hash not in self.children:
+            return []
+        return [
+            self.__remove(block_hash)
+            for block_hash in list(self.children[parent_hash])
+        ]
@@ -0,0 +1,340 @@
+"""Deterministic simulation of many nodes in a single process, on a virtual
+clock. Runs with the same arguments and seed replay exactly."""
+# Arguments:
+#
+# 1: Number of nodes on the bitcoin network
+# 2: Block size to create the block
+# 3: Duration (in virtual seconds) of the simulation
+# 4: Number of miners in the blockchain system
+# 5: Arity of Merkel Tree
+# 6: Difficulty of POW. No nonce is searched: the time to find a block is
+#    simulated from the hash rate and the difficulty.
+# 7: Hash rate of each miner, in hashes per virtual second
+# 8: (Optional) Seed of the random generators. Defaults to 0.
+# 9: (Optional) Mean latency of a link, in seconds. The latency of every
+#    node is drawn within 50% of it, and a link has the mean latency of its
+#    two nodes. Defaults to 0.1.
+# 10: (Optional) Bandwidth of a link, in bytes per second. Unlimited if 0.
+#     Defaults to 0.
+# 11: (Optional) Number of random peers each message is gossiped to. Messages
+#     are broadcast to every node if 0. Defaults to 0.
+# 12: (Optional) Seconds between the transactions of each node. Defaults to
+#     1.0.
+# 13: (Optional) Seconds between blocks the difficulty is retargeted to,
+#     starting from the difficulty of argument 6. Fixed difficulty if 0.
+#     Defaults to 0.
+# 14: (Optional) Directory of the logs. Defaults to ./logs/
+
+import os
+import sys
+import time
+import random
+import itertools
+import contextlib
+from Crypto.PublicKey import RSA
+from Crypto.Util.number import getPrime, inverse
+from main import PublicKey
+from node import Node
+from timers import Timers
+from transport import SimulatedTransport
+from verifier import Verifier
+
+# Public exponent of the generated keys
+RSA_EXPONENT = 65537
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        """VirtualClock Ctor. Time only moves when the simulation advances
+        it to the next timer.
+
+        Args:
+            start (float, optional): Initial time in seconds. Defaults to 0.0.
+        """
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+class Network:
+    def __init__(self,
+                 clock,
+                 timers,
+                 num_nodes,
+                 latency=0.1,
+                 bandwidth=None,
+                 jitter=0.5,
+                 seed=0):
+        """Network Ctor. Messages reach their receiver after the latency of
+        the link, plus their transmission time if the bandwidth is limited.
+        Every node has a latency of its own, and a link has the mean latency
+        of its two nodes. A link transmits one message at a time, so messages
+        queue behind the ones sent before them on the same link.
+
+        Args:
+            clock (VirtualClock)
+            timers (Timers): Timers of the simulation, on the virtual clock
+            num_nodes (int)
+            latency (float, optional): Mean latency of a link in seconds.
+                Defaults to 0.1.
+            bandwidth (float, optional): Bytes per second of a link.
+                Unlimited if None. Defaults to None.
+            jitter (float, optional): Latencies of the nodes are drawn
+                uniformly within this fraction of the mean. Defaults to 0.5.
+            seed (int, optional): Seed the latencies are drawn from.
+                Defaults to 0.
+        """
+        self.clock = clock
+        self.timers = timers
+        self.num_nodes = num_nodes
+        self.bandwidth = bandwidth
+        rng = random.Random(seed)
+        self.latencies = [
+            latency * rng.uniform(1 - jitter, 1 + jitter)
+            for _ in range(num_nodes)
+        ]
+        # Set by the Simulation once the nodes are created
+        self.nodes = [None] * num_nodes
+
+        # Busy format - (sender, receiver): time the link is free again
+        self.busy = {}
+        # Nodes due to be stepped at the current time
+        self.waking = set()
+        self.messages = 0
+        self.bytes = 0
+
+    def link_latency(self, sender, receiver):
+        """Latency of a link. Override to model another topology.
+
+        Args:
+            sender (int)
+            receiver (int)
+
+        Returns:
+            float: Seconds
+        """
+        return (self.latencies[sender] + self.latencies[receiver]) / 2
+
+    def send(self, sender, receiver, data):
+        """Carry a message over the link between two nodes
+
+        Args:
+            sender (int)
+            receiver (int)
+            data (bytes or str): Output of wire.encode_message
+        """
+        now = self.clock()
+        sent = now
+        if self.bandwidth:
+            link = (sender, receiver)
+            sent = max(now, self.busy.get(link, now)) + \
+                len(data) / self.bandwidth
+            self.busy[link] = sent
+        self.messages += 1
+        self.bytes += len(data)
+        self.timers.call_later(
+            sent - now + self.link_latency(sender, receiver),
+            lambda: self.__arrive(receiver, data))
+
+    def __arrive(self, receiver, data):
+        self.nodes[receiver].transport.arrived.append(data)
+        self.__step(receiver)
+
+    def wake(self, node_id):
+        """Step a node at the current time, once the node which is running
+        returns. Called when a node delivers a message to itself, or when
+        its simulated mining finishes.
+
+        Args:
+            node_id (int)
+        """
+        if node_id in self.waking:
+            return
+        self.waking.add(node_id)
+        self.timers.call_later(0, lambda: self.__step(node_id))
+
+    def __step(self, node_id):
+        self.waking.discard(node_id)
+        node = self.nodes[node_id]
+        node.step()
+        if node.transport.pending():
+            # More than a batch arrived
+            self.wake(node_id)
+
+
+def generate_wallets(num_nodes, seed):
+    """Generate the key pair of every node from the seed, so that signatures
+    and hashes are the same in every run. Generating a 1024-bit key takes
+    about 0.1s, so keys are built from pairs of a small pool of primes
+    instead. Keys sharing a prime are easily factored, which does not matter
+    to a simulation.
+
+    Args:
+        num_nodes (int)
+        seed (int)
+
+    Returns:
+        List[_RSAObj]: Private key of every node
+    """
+    rng = random.Random(seed)
+    primes = []
+    while len(primes) * (len(primes) - 1) // 2 < num_nodes:
+        prime = getPrime(512, rng.randbytes)
+        # The exponent must be invertible modulo prime - 1
+        if (prime - 1) % RSA_EXPONENT:
+            primes.append(prime)
+
+    private_keys = []
+    for p, q in itertools.islice(itertools.combinations(primes, 2),
+                                 num_nodes):
+        d = inverse(RSA_EXPONENT, (p - 1) * (q - 1))
+        private_keys.append(
+            RSA.construct((p * q, RSA_EXPONENT, d, p, q),
+                          consistency_check=False))
+    return private_keys
+
+
+class Simulation:
+    def __init__(self,
+                 num_nodes,
+                 block_size,
+                 num_miners,
+                 arity,
+                 difficulty,
+                 hash_rate,
+                 seed=0,
+                 latency=0.1,
+                 bandwidth=None,
+                 fanout=0,
+                 tx_interval=1.0,
+                 block_interval=None,
+                 log_dir='./logs/'):
+        """Simulation Ctor. Every node runs in this process, on the timers of
+        the simulation and a virtual clock. Handling a message takes no
+        virtual time, and blocks are found after an exponential delay drawn
+        for the hash rate of their miner. No nonce is searched or checked.
+
+        Args:
+            num_nodes (int)
+            block_size (int): Number of transactions in a single block
+            num_miners (int): Nodes 0 to num_miners - 1 are miners
+            arity (int): Arity of the Merkle tree
+            difficulty (int): Initial difficulty of the simulated proof of
+                work
+            hash_rate (float): Hashes per virtual second of each miner
+            seed (int, optional): Seed of the random generators. Defaults
+                to 0.
+            latency (float, optional): See Network. Defaults to 0.1.
+            bandwidth (float, optional): See Network. Defaults to None.
+            fanout (int, optional): See Transport. Defaults to 0.
+            tx_interval (float, optional): Seconds between the transactions
+                of each node. Defaults to 1.0.
+            block_interval (float, optional): Seconds between blocks the
+                difficulty is retargeted to. Defaults to None.
+            log_dir (str, optional): Directory of the event logs. Defaults to
+                './logs/'.
+        """
+        # Nodes draw from the module random, which is seeded first so that
+        # they make the same choices in every run
+        random.seed(seed)
+        self.clock = VirtualClock()
+        self.timers = Timers(self.clock)
+        self.network = Network(self.clock,
+                               self.timers,
+                               num_nodes,
+                               latency,
+                               bandwidth,
+                               seed=seed)
+
+        private_keys = generate_wallets(num_nodes, seed)
+        keys = [
+            PublicKey(private_key.publickey().exportKey('PEM').decode('utf-8'))
+            for private_key in private_keys
+        ]
+        # Every node would get the same result checking a signature, so it
+        # is checked once for all of them
+        verifier = Verifier(keys)
+        self.nodes = []
+        for node_id in range(num_nodes):
+            is_miner = node_id < num_miners
+            self.nodes.append(
+                Node(node_id,
+                     private_keys[node_id],
+                     is_miner,
+                     block_size,
+                     keys,
+                     None,
+                     arity,
+                     difficulty,
+                     fanout=fanout,
+                     transport=SimulatedTransport(node_id, self.network,
+                                                  fanout),
+                     tx_interval=tx_interval,
+                     block_interval=block_interval,
+                     clock=self.clock,
+                     verifier=verifier,
+                     hash_rate=hash_rate,
+                     log_dir=log_dir))
+        self.network.nodes = self.nodes
+
+    def run(self, duration):
+        """Start every node, run the timers in order of their deadline until
+        `duration` virtual seconds have passed, then shut the nodes down
+
+        Args:
+            duration (float)
+        """
+        end = self.clock.now + duration
+        for node in self.nodes:
+            node.start(duration, self.timers)
+
+        while True:
+            deadline = self.timers.next_deadline()
+            if deadline is None or deadline > end:
+                break
+            self.clock.now = max(self.clock.now, deadline)
+            self.timers.run_due()
+        self.clock.now = end
+
+        for node in self.nodes:
+            node.shutdown()
+
+
+if __name__ == '__main__':
+    num_nodes = int(sys.argv[1])
+    block_size = int(sys.argv[2])
+    duration = float(sys.argv[3])
+    num_miners = int(sys.argv[4])
+    arity = int(sys.argv[5])
+    difficulty = int(sys.argv[6])
+    hash_rate = float(sys.argv[7])
+    seed = int(sys.argv[8]) if len(sys.argv) > 8 else 0
+    latency = float(sys.argv[9]) if len(sys.argv) > 9 else 0.1
+    bandwidth = float(sys.argv[10]) if len(sys.argv) > 10 else 0
+    fanout = int(sys.argv[11]) if len(sys.argv) > 11 else 0
+    tx_interval = float(sys.argv[12]) if len(sys.argv) > 12 else 1.0
+    block_interval = float(sys.argv[13]) if len(sys.argv) > 13 else 0
+    log_dir = sys.argv[14] if len(sys.argv) > 14 else './logs/'
+
+    started = time.monotonic()
+    os.makedirs(log_dir, exist_ok=True)
+    # The output of the nodes goes to a file, next to their event logs
+    with open(os.path.join(log_dir, 'nodes.out'), 'w') as out:
+        with contextlib.redirect_stdout(out):
+            simulation = Simulation(num_nodes, block_size, num_miners, arity,
+                                    difficulty, hash_rate, seed, latency,
+                                    bandwidth or None, fanout, tx_interval,
+                                    block_interval or None, log_dir)
+            simulation.run(duration)
+
+    heights = [node.bc.get_height() for node in simulation.nodes]
+    tips = [node.bc.main for node in simulation.nodes]
+    print('[INFO]: Simulated ' + str(duration) + 's of ' + str(num_nodes) +
+          ' nodes in {:.1f}s'.format(time.monotonic() - started))
+    print('[INFO]: Messages: ' + str(simulation.network.messages) +
+          ', bytes: ' + str(simulation.network.bytes))
+    print('[INFO]: Main chain height: ' + str(min(heights)) + ' to ' +
+          str(max(heights)) + ', nodes on the most common tip: ' +
+          str(max(tips.count(tip) for tip in set(tips))) + '/' +
+          str(num_nodes))
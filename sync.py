@@ -0,0 +1,129 @@
+"""Headers-first download of the blocks a node missed, from several peers"""
+import time
+from collections import OrderedDict
+
+# Headers sent in answer to a single GETHEADERS
+MAX_HEADERS = 2000
+# Blocks asked for in a single GETBLOCKS
+MAX_BLOCKS_PER_REQUEST = 16
+# Blocks requested from a single peer and not received yet
+MAX_BLOCKS_PER_PEER = 64
+# Blocks requested from all peers and not received yet. Blocks arriving ahead
+# of their parent wait in the orphan pool, so this stays below its size.
+MAX_BLOCKS_IN_FLIGHT = 128
+
+
+class ChainSync:
+    def __init__(self, timeout=2.0, clock=time.monotonic):
+        """ChainSync Ctor. Headers are downloaded first and added to the
+        header chain of the Blockchain, then the blocks missing behind them
+        are spread over the peers which announced them.
+
+        Args:
+            timeout (float, optional): Seconds after which a request with no
+                answer is sent again, to another peer if possible.
+                Defaults to 2.0.
+            clock (callable, optional): Returns the current time in seconds.
+        """
+        self.timeout = timeout
+        self.clock = clock
+
+        # Sources format - hash: set(peer) which announced the header
+        self.sources = {}
+        # Blocks to request, in the order of their headers
+        self.queue = OrderedDict()
+        # In flight format - hash: (peer, deadline)
+        self.in_flight = {}
+        # Load format - peer: number of blocks in flight
+        self.load = {}
+        # Header requests format - peer: deadline
+        self.header_requests = {}
+
+    def request_headers(self, peer):
+        """Whether headers can be requested from a peer, which is the case
+        unless a request to it is still waiting for an answer
+
+        Args:
+            peer (int)
+
+        Returns:
+            boolean: True if the request is recorded as sent
+        """
+        now = self.clock()
+        if self.header_requests.get(peer, now) > now:
+            return False
+        self.header_requests[peer] = now + self.timeout
+        return True
+
+    def add_headers(self, peer, headers, known):
+        """Queue the blocks of headers announced by a peer
+
+        Args:
+            peer (int)
+            headers (List[BlockHeader]): Valid headers in chain order
+            known (callable): Whether a block hash was already received
+        """
+        self.header_requests.pop(peer, None)
+        for header in headers:
+            block_hash = header.get_hash()
+            if known(block_hash):
+                continue
+            self.sources.setdefault(block_hash, set()).add(peer)
+            if block_hash not in self.in_flight:
+                self.queue[block_hash] = None
+
+    def block_received(self, block_hash):
+        """Forget a block once received, from any peer
+
+        Args:
+            block_hash (str)
+        """
+        self.sources.pop(block_hash, None)
+        self.queue.pop(block_hash, None)
+        entry = self.in_flight.pop(block_hash, None)
+        if entry is not None:
+            self.load[entry[0]] -= 1
+
+    def next_requests(self):
+        """Assign the queued blocks to the least loaded peers which announced
+        them. Requests which timed out are assigned again first.
+
+        Returns:
+            List[tuple]: (peer, List of block hashes), with at most
+                MAX_BLOCKS_PER_REQUEST hashes each
+        """
+        now = self.clock()
+        expired = [
+            block_hash for block_hash, (_, deadline) in self.in_flight.items()
+            if deadline <= now
+        ]
+        for block_hash in reversed(expired):
+            peer, _ = self.in_flight.pop(block_hash)
+            self.load[peer] -= 1
+            # Prefer the other peers which announced the block next time
+            sources = self.sources[block_hash]
+            if len(sources) > 1:
+                sources.discard(peer)
+            self.queue[block_hash] = None
+            self.queue.move_to_end(block_hash, last=False)
+
+        requests = {}
+        for block_hash in list(self.queue):
+            if len(self.in_flight) >= MAX_BLOCKS_IN_FLIGHT:
+                break
+            peers = [
+                peer for peer in self.sources[block_hash]
+                if self.load.get(peer, 0) < MAX_BLOCKS_PER_PEER
+            ]
+            if not peers:
+                continue
+            peer = min(peers, key=lambda peer: self.load.get(peer, 0))
+            del self.queue[block_hash]
+            self.in_flight[block_hash] = (peer, now + self.timeout)
+            self.load[peer] = self.load.get(peer, 0) + 1
+            batches = requests.setdefault(peer, [[]])
+            if len(batches[-1]) == MAX_BLOCKS_PER_REQUEST:
+                batches.append([])
+            batches[-1].append(block_hash)
+        return [(peer, batch) for peer, batches in requests.items()
+                for batch in batches]
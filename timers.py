@@ -0,0 +1,77 @@
+"""Timers driving the event loop of a node"""
+import time
+import heapq
+import itertools
+
+
+class Timers:
+    def __init__(self, clock=time.monotonic):
+        """Timers Ctor
+
+        Args:
+            clock (callable, optional): Returns the current time in seconds.
+        """
+        self.clock = clock
+        self.order = itertools.count()
+        # Heap of [deadline, order, callback, interval], where callback is
+        # None for a cancelled timer and interval None for a one-shot timer
+        self.heap = []
+
+    def call_later(self, delay, callback, interval=None):
+        """Run `callback` after `delay` seconds, then every `interval`
+        seconds if given
+
+        Args:
+            delay (float)
+            callback (callable): Called without arguments
+            interval (float, optional): Period of a repeating timer
+
+        Returns:
+            list: Handle to pass to cancel
+        """
+        timer = [self.clock() + delay, next(self.order), callback, interval]
+        heapq.heappush(self.heap, timer)
+        return timer
+
+    def call_every(self, interval, callback):
+        return self.call_later(interval, callback, interval)
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def next_deadline(self):
+        """Time at which the earliest timer is due
+
+        Returns:
+            float: None if no timer is set
+        """
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def next_timeout(self):
+        """Seconds until the earliest timer is due
+
+        Returns:
+            float: None if no timer is set
+        """
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - self.clock())
+
+    def run_due(self):
+        """Run the callbacks of the timers which are due"""
+        now = self.clock()
+        while self.heap and self.heap[0][0] <= now:
+            timer = heapq.heappop(self.heap)
+            deadline, _, callback, interval = timer
+            if callback is None:
+                continue
+            if interval is not None:
+                timer[0] = max(deadline + interval, now)
+                timer[1] = next(self.order)
+                heapq.heappush(self.heap, timer)
+            callback()
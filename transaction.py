@@ -0,0 +1,136 @@
+"""Implementation to represent a single transaction in the custom blockchain"""
+import struct
+import hashlib
+
+TX_TYPES = {'INIT': 0, 'TRANSFER': 1, 'MINE': 2}
+TX_NAMES = {code: name for name, code in TX_TYPES.items()}
+
+# type, sender, amount
+TX_HEADER = struct.Struct('>BIq')
+U8 = struct.Struct('>B')
+U16 = struct.Struct('>H')
+# Bytes of the digest identifying a transaction in a compact block
+SHORT_ID_SIZE = 6
+
+
+class Transaction:
+    __slots__ = ('type', 'sender', 'receiver', 'amount', 'timestamp',
+                 'signature', '_bytes', '_digest')
+
+    def __init__(self, tx_type, sender, receiver, amount, timestamp,
+                 signature=b''):
+        """Transaction Ctor. Fields must not change once the canonical bytes
+        or the digest have been computed, as both are cached.
+
+        Args:
+            tx_type (str): INIT/TRANSFER/MINE
+            sender (int): Node id of the sender
+            receiver (str): Public key of the receiver
+            amount (int)
+            timestamp (str)
+            signature (bytes, optional): Signature of the canonical bytes by
+                the sender
+        """
+        self.type = tx_type
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+        self.timestamp = timestamp
+        self.signature = signature
+        self._bytes = None
+        self._digest = None
+
+    @classmethod
+    def from_json(cls, tx, signature=b''):
+        """Ctor from the JSON of a transaction (Format in README)
+
+        Args:
+            tx (dict)
+            signature (bytes, optional)
+
+        Returns:
+            Transaction instance
+        """
+        return cls(tx['type'], tx['sender'], tx['receiver'], tx['amount'],
+                   tx['timestamp'], signature)
+
+    @classmethod
+    def from_bytes(cls, data, signature=b''):
+        """Ctor from the canonical bytes of a transaction, which are kept so
+        that they are never serialized again
+
+        Args:
+            data (bytes): Output of to_bytes
+            signature (bytes, optional)
+
+        Returns:
+            Transaction instance
+        """
+        tx_type, sender, amount = TX_HEADER.unpack_from(data)
+        offset = TX_HEADER.size
+        size = data[offset]
+        timestamp = data[offset + 1:offset + 1 + size].decode('utf-8')
+        offset += 1 + size
+        size, = U16.unpack_from(data, offset)
+        receiver = data[offset + 2:offset + 2 + size].decode('utf-8')
+
+        tx = cls(TX_NAMES[tx_type], sender, receiver, amount, timestamp,
+                 signature)
+        tx._bytes = bytes(data)
+        return tx
+
+    def to_json(self):
+        """Return the JSON of the transaction, without the signature
+
+        Returns:
+            dict
+        """
+        return {
+            "type": self.type,
+            "sender": self.sender,
+            "receiver": self.receiver,
+            "amount": self.amount,
+            "timestamp": self.timestamp
+        }
+
+    def to_bytes(self):
+        """Canonical form of the transaction, which is both signed by its
+        sender and hashed as a leaf of the Merkle tree
+
+        Returns:
+            bytes
+        """
+        if self._bytes is None:
+            timestamp = self.timestamp.encode('utf-8')
+            receiver = self.receiver.encode('utf-8')
+            self._bytes = b''.join([
+                TX_HEADER.pack(TX_TYPES[self.type], self.sender, self.amount),
+                U8.pack(len(timestamp)), timestamp,
+                U16.pack(len(receiver)), receiver
+            ])
+        return self._bytes
+
+    def digest(self):
+        """Return the raw SHA-1 digest of the canonical bytes
+
+        Returns:
+            bytes
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.to_bytes()).digest()
+        return self._digest
+
+    def short_id(self):
+        """Return the prefix of the digest sent for the transaction in a
+        compact block
+
+        Returns:
+            bytes
+        """
+        return self.digest()[:SHORT_ID_SIZE]
+
+    def __eq__(self, other):
+        return isinstance(other, Transaction) and self.digest() == other.digest()
+
+    def __hash__(self):
+        return hash(self.digest())
@@ -0,0 +1,347 @@
+"""Transports carrying the encoded network messages between nodes"""
+import os
+import queue
+import random
+import socket
+import struct
+import hashlib
+from collections import OrderedDict, deque
+
+
+class Transport:
+    def __init__(self, node_id, num_nodes, fanout=0, seen_size=65536):
+        """Transport Ctor. Messages of the node itself are delivered back to
+        it without going through the network.
+
+        Args:
+            node_id (int): Node id owning the transport
+            num_nodes (int): Number of nodes on the network
+            fanout (int, optional): Gossip to this many random peers, which
+                relay the message on first receipt. Broadcast to every node
+                if 0. Defaults to 0.
+            seen_size (int, optional): Digests of gossiped messages
+                remembered to drop duplicates. Defaults to 65536.
+        """
+        self.id = node_id
+        self.peers = [peer for peer in range(num_nodes) if peer != node_id]
+        self.fanout = fanout
+        self.seen_size = seen_size
+
+        # Messages sent by the node to itself
+        self.inbox = deque()
+        # Digests of the messages already received, least recent first
+        self.seen = OrderedDict()
+        # Messages which could not be sent or received whole
+        self.dropped = 0
+
+    def _send(self, peer, data):
+        """Send data to a single peer"""
+        raise NotImplementedError
+
+    def _recv(self, timeout):
+        """Receive the next message from the network
+
+        Args:
+            timeout (float): Seconds to wait for, 0 to not block
+
+        Returns:
+            bytes or str: None if nothing arrived
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __targets(self):
+        if self.fanout and self.fanout < len(self.peers):
+            return random.sample(self.peers, self.fanout)
+        return self.peers
+
+    def __first_receipt(self, data):
+        """Remember the digest of a gossiped message
+
+        Returns:
+            boolean: False if the message was seen before
+        """
+        if not self.fanout:
+            return True
+        digest = hashlib.sha1(
+            data.encode('utf-8') if isinstance(data, str) else data).digest()
+        if digest in self.seen:
+            self.seen.move_to_end(digest)
+            return False
+        self.seen[digest] = True
+        if len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+        return True
+
+    def broadcast(self, data, loopback=True):
+        """Send a message to every node, or to `fanout` random peers which
+        relay it further
+
+        Args:
+            data (bytes or str): Output of wire.encode_message
+            loopback (bool, optional): Also deliver the message to the node
+                itself. Defaults to True.
+        """
+        self.__first_receipt(data)
+        if loopback:
+            self.deliver(data)
+        for peer in self.__targets():
+            self._send(peer, data)
+
+    def relay(self, data):
+        """Gossip a message received from the network further. Broadcast
+        messages already reached every node, so they are not relayed.
+
+        Args:
+            data (bytes or str): Message returned by poll
+        """
+        if self.fanout:
+            for peer in self.__targets():
+                self._send(peer, data)
+
+    def send(self, peer, data):
+        """Send a message to a single node
+
+        Args:
+            peer (int): Node id of the receiver
+            data (bytes or str): Output of wire.encode_message
+        """
+        if peer == self.id:
+            self.deliver(data)
+        else:
+            self._send(peer, data)
+
+    def deliver(self, data):
+        """Deliver a message to the node itself"""
+        self.inbox.append(data)
+
+    def wakeup(self):
+        """Interrupt a poll waiting for messages. Safe to call from another
+        thread."""
+        self._send(self.id, b'')
+
+    def poll(self, max_count, timeout=0):
+        """Read the messages which have arrived, dropping those already
+        received. Messages to gossip further are passed to relay.
+
+        Args:
+            max_count (int): Maximum messages returned
+            timeout (float, optional): Seconds to wait for the first message
+                if none is available. Defaults to 0.
+
+        Returns:
+            List: Messages in the order they arrived
+        """
+        messages = []
+        while self.inbox and len(messages) < max_count:
+            messages.append(self.inbox.popleft())
+
+        while len(messages) < max_count:
+            data = self._recv(0 if messages else timeout)
+            if not data:
+                # Nothing arrived, or the node was woken up
+                break
+            if self.__first_receipt(data):
+                messages.append(data)
+        return messages
+
+
+class QueueTransport(Transport):
+    def __init__(self, node_id, queues, fanout=0, seen_size=65536):
+        """QueueTransport Ctor
+
+        Args:
+            node_id (int)
+            queues (List[multiprocessing.Queue]): Queue of every node
+            fanout (int, optional): See Transport. Defaults to 0.
+            seen_size (int, optional): See Transport. Defaults to 65536.
+        """
+        super().__init__(node_id, len(queues), fanout, seen_size)
+        self.queues = queues
+
+    def _send(self, peer, data):
+        self.queues[peer].put(data)
+
+    def _recv(self, timeout):
+        try:
+            if timeout:
+                return self.queues[self.id].get(timeout=timeout)
+            return self.queues[self.id].get(False)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Drain the queue of the node so that its feeder threads exit"""
+        own = self.queues[self.id]
+        while not own.empty():
+            try:
+                own.get(timeout=0.001)
+            except queue.Empty:
+                pass
+        own.close()
+
+
+class SimulatedTransport(Transport):
+    def __init__(self, node_id, network, fanout=0, seen_size=65536):
+        """SimulatedTransport Ctor. Messages go over the links of a
+        simulated network, which delivers them on a virtual clock and steps
+        the receiving node once they arrive.
+
+        Args:
+            node_id (int)
+            network (simulate.Network): Network shared by all the nodes
+            fanout (int, optional): See Transport. Defaults to 0.
+            seen_size (int, optional): See Transport. Defaults to 65536.
+        """
+        super().__init__(node_id, network.num_nodes, fanout, seen_size)
+        self.network = network
+        # Messages which arrived from the network, not read yet
+        self.arrived = deque()
+
+    def _send(self, peer, data):
+        self.network.send(self.id, peer, data)
+
+    def _recv(self, timeout):
+        # Never waits, the node is stepped again when a message arrives
+        return self.arrived.popleft() if self.arrived else None
+
+    def deliver(self, data):
+        super().deliver(data)
+        self.network.wake(self.id)
+
+    def wakeup(self):
+        self.network.wake(self.id)
+
+    def pending(self):
+        """Whether messages are left to read"""
+        return bool(self.inbox or self.arrived)
+
+
+def bind_sockets(directory, num_nodes):
+    """Bind a Unix datagram socket for every node. Called before spawning
+    the nodes, so that no message is sent to a node which is not listening.
+
+    Args:
+        directory (str): Directory holding the socket files
+        num_nodes (int)
+
+    Returns:
+        tuple: (List[socket.socket], List[str]) Sockets and their paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    sockets, paths = [], []
+    for node_id in range(num_nodes):
+        path = os.path.join(directory, 'node_' + str(node_id) + '.sock')
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sockets.append(sock)
+        paths.append(path)
+    return sockets, paths
+
+
+class SocketTransport(Transport):
+    # Largest message read from the socket
+    MAX_DATAGRAM = 2**20
+    # Messages above this size are split into chunks, as a datagram larger
+    # than the send buffer of the socket fails
+    MAX_CHUNK = 65536
+    # Chunks start with a byte which begins no message, followed by the
+    # sender, message number, chunk index and number of chunks
+    CHUNK_MARKER = b'\x00'
+    CHUNK_HEADER = struct.Struct('>IIHH')
+    # Messages being reassembled from chunks, the oldest being dropped
+    MAX_PARTIAL = 64
+
+    def __init__(self, node_id, sock, paths, fanout=0, seen_size=65536):
+        """SocketTransport Ctor. Messages are datagrams between Unix sockets,
+        avoiding the pickling and feeder threads of the queues.
+
+        Args:
+            node_id (int)
+            sock (socket.socket): Socket of the node, from bind_sockets
+            paths (List[str]): Socket path of every node
+            fanout (int, optional): See Transport. Defaults to 0.
+            seen_size (int, optional): See Transport. Defaults to 65536.
+        """
+        super().__init__(node_id, len(paths), fanout, seen_size)
+        self.sock = sock
+        self.paths = paths
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # A peer which does not read its socket only delays the node briefly
+        self.sender.settimeout(1.0)
+        self.sent_messages = 0
+        # Partial format - (sender, message number): list of chunks, None
+        # where not received yet
+        self.partial = OrderedDict()
+
+    def _send(self, peer, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if len(data) <= self.MAX_CHUNK:
+            datagrams = [data]
+        else:
+            self.sent_messages += 1
+            count = (len(data) + self.MAX_CHUNK - 1) // self.MAX_CHUNK
+            datagrams = [
+                self.CHUNK_MARKER + self.CHUNK_HEADER.pack(
+                    self.id, self.sent_messages, index, count) +
+                data[index * self.MAX_CHUNK:(index + 1) * self.MAX_CHUNK]
+                for index in range(count)
+            ]
+        try:
+            for datagram in datagrams:
+                self.sender.sendto(datagram, self.paths[peer])
+        except OSError:
+            # The peer has stopped, or its socket stayed full
+            self.dropped += 1
+
+    def __reassemble(self, datagram):
+        """Store a chunk of a large message
+
+        Returns:
+            bytes: The whole message once its last chunk arrived, else None
+        """
+        sender, number, index, count = self.CHUNK_HEADER.unpack_from(
+            datagram, len(self.CHUNK_MARKER))
+        key = (sender, number)
+        chunks = self.partial.get(key)
+        if chunks is None:
+            chunks = self.partial[key] = [None] * count
+            if len(self.partial) > self.MAX_PARTIAL:
+                # Some chunk of the oldest message was lost
+                self.partial.popitem(last=False)
+                self.dropped += 1
+        if index < len(chunks):
+            chunks[index] = datagram[len(self.CHUNK_MARKER) +
+                                     self.CHUNK_HEADER.size:]
+        if None in chunks:
+            return None
+        del self.partial[key]
+        return b''.join(chunks)
+
+    def _recv(self, timeout):
+        while True:
+            self.sock.settimeout(timeout)
+            try:
+                data = self.sock.recv(self.MAX_DATAGRAM)
+            except (BlockingIOError, socket.timeout):
+                return None
+            if data[:1] != self.CHUNK_MARKER:
+                break
+            data = self.__reassemble(data)
+            if data is not None:
+                break
+        # Messages of the JSON debug mode are read back as text
+        if data[:1] == b'{':
+            return data.decode('utf-8')
+        return data
+
+    def close(self):
+        self.sender.close()
+        self.sock.close()
+        if os.path.exists(self.paths[self.id]):
+            os.remove(self.paths[self.id])
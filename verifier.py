@@ -0,0 +1,254 @@
+"""Signature verification with cached public keys, shared by a node for
+all the messages it receives"""
+import time
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from Crypto.PublicKey import RSA
+
+# DigestInfo of SHA-1, with and without the NULL parameters, which precedes
+# the digest in a PKCS#1 v1.5 signature
+SHA1_DIGEST_INFOS = (bytes.fromhex('3021300906052b0e03021a05000414'),
+                     bytes.fromhex('301f300706052b0e03021a0414'))
+SHA1_SIZE = 20
+
+# Verifiers of a pool worker, built from the PEM keys given to the pool
+_worker_verifiers = None
+
+
+def _init_worker(pem_keys):
+    global _worker_verifiers
+    _worker_verifiers = [RsaPublicKey(pem_key) for pem_key in pem_keys]
+
+
+def _verify_chunk(chunk):
+    return [
+        _worker_verifiers[node_id].verify(message, signature)
+        for node_id, message, signature in chunk
+    ]
+
+
+class RsaPublicKey:
+    __slots__ = ('n', 'e', 'size', 'prefixes')
+
+    def __init__(self, pem_key):
+        """RsaPublicKey Ctor. Checks the PKCS#1 v1.5 signatures made over
+        SHA-1 digests by Crypto.Signature.PKCS1_v1_5. The padding expected
+        before the digest is computed once per key, instead of being encoded
+        again for every signature.
+
+        Args:
+            pem_key (str): PEM encoded public key
+        """
+        key = RSA.importKey(pem_key)
+        self.n = int(key.n)
+        self.e = int(key.e)
+        self.size = (self.n.bit_length() + 7) // 8
+        self.prefixes = tuple(
+            b'\x00\x01' + b'\xff' *
+            (self.size - 3 - len(info) - SHA1_SIZE) + b'\x00' + info
+            for info in SHA1_DIGEST_INFOS)
+
+    def verify(self, message, signature):
+        """Verify the signature of a message
+
+        Args:
+            message (bytes)
+            signature (bytes)
+
+        Returns:
+            boolean
+        """
+        if len(signature) != self.size:
+            return False
+        value = int.from_bytes(signature, 'big')
+        if value >= self.n:
+            return False
+        encoded = pow(value, self.e, self.n).to_bytes(self.size, 'big')
+        return encoded[-SHA1_SIZE:] == hashlib.sha1(message).digest() and \
+            encoded[:-SHA1_SIZE] in self.prefixes
+
+
+class Verifier:
+    def __init__(self, keys, workers=0, cache_size=8192):
+        """Verifier Ctor
+
+        Args:
+            keys (multiprocessing.Array[str]): List of public keys for all nodes
+            workers (int, optional): Processes used by verify_batch. Batches
+                are verified in the calling process if 0. Defaults to 0.
+            cache_size (int, optional): Number of verified messages
+                remembered. Defaults to 8192.
+        """
+        self.keys = keys
+        self.workers = workers
+        self.cache_size = cache_size
+        self.pool = None
+
+        # Cache format - node_id: RsaPublicKey of the node
+        self.verifiers = {}
+        # Cache format - (node_id, message digest): True, least recently used
+        # first. A transaction signed by its sender is verified once, whether
+        # it is first seen alone or inside a block.
+        self.verified_cache = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.cache_hits = 0
+        self.verified = 0
+        self.verify_time = 0.0
+
+    def is_known(self, node_id):
+        """Whether `node_id` is the id of a node with a public key
+
+        Args:
+            node_id (int): Node id read from a message, so of any type
+
+        Returns:
+            boolean
+        """
+        return isinstance(node_id, int) and 0 <= node_id < len(self.keys)
+
+    def get_key(self, node_id):
+        """Get the public key associated with node `node_id`
+
+        Args:
+            node_id (int)
+
+        Returns:
+            str: PEM encoded key, None if there is no such node
+        """
+        if not self.is_known(node_id):
+            return None
+        return self.keys[node_id].key
+
+    def get_verifier(self, node_id):
+        """Get the verifier for signatures of node `node_id`, parsing its
+        public key only on the first use
+
+        Args:
+            node_id (int)
+
+        Returns:
+            RsaPublicKey: None if there is no such node
+        """
+        verifier = self.verifiers.get(node_id)
+        if verifier is None:
+            if not self.is_known(node_id):
+                return None
+            self.misses += 1
+            verifier = RsaPublicKey(self.get_key(node_id))
+            self.verifiers[node_id] = verifier
+        else:
+            self.hits += 1
+        return verifier
+
+    def __cache_key(self, node_id, message):
+        return node_id, hashlib.sha1(message).digest()
+
+    def __is_cached(self, key):
+        if key in self.verified_cache:
+            self.verified_cache.move_to_end(key)
+            self.cache_hits += 1
+            return True
+        return False
+
+    def __remember(self, key):
+        self.verified_cache[key] = True
+        if len(self.verified_cache) > self.cache_size:
+            self.verified_cache.popitem(last=False)
+
+    def verify(self, node_id, message, signature):
+        """Verify the signature of a single message
+
+        Args:
+            node_id (int): Node that signed the message
+            message (bytes): Signed message
+            signature (bytes): Raw signature
+
+        Returns:
+            boolean
+        """
+        key = self.__cache_key(node_id, message)
+        if self.__is_cached(key):
+            return True
+
+        start = time.perf_counter()
+        verifier = self.get_verifier(node_id)
+        if verifier is None:
+            return False
+        valid = verifier.verify(message, signature)
+        self.verify_time += time.perf_counter() - start
+        self.verified += 1
+        if valid:
+            self.__remember(key)
+        return valid
+
+    def verify_batch(self, items):
+        """Verify the signatures of many messages in one pass
+
+        Args:
+            items (List): (node_id, message, signature) tuples, with the same
+                types as the arguments of verify
+
+        Returns:
+            List[boolean]: Validity of each item
+        """
+        if not self.workers or len(items) < 2 * self.workers:
+            return [self.verify(*item) for item in items]
+
+        # Only pay for the crypto of messages not verified before. Those of
+        # unknown nodes are invalid.
+        results = [self.is_known(item[0]) for item in items]
+        keys = [self.__cache_key(item[0], item[1]) for item in items]
+        positions = [
+            position for position, key in enumerate(keys)
+            if results[position] and not self.__is_cached(key)
+        ]
+        items = [items[position] for position in positions]
+        if not items:
+            return results
+
+        if self.pool is None:
+            pem_keys = [self.keys[i].key for i in range(len(self.keys))]
+            self.pool = multiprocessing.Pool(self.workers, _init_worker,
+                                             (pem_keys, ))
+        start = time.perf_counter()
+        chunk_size = -(-len(items) // self.workers)
+        chunks = [
+            items[index:index + chunk_size]
+            for index in range(0, len(items), chunk_size)
+        ]
+        verified = [
+            valid for chunk in self.pool.map(_verify_chunk, chunks)
+            for valid in chunk
+        ]
+        self.verify_time += time.perf_counter() - start
+        self.verified += len(items)
+
+        for position, valid in zip(positions, verified):
+            results[position] = valid
+            if valid:
+                self.__remember(keys[position])
+        return results
+
+    def stats(self):
+        """Return the cache hits and the verification throughput
+
+        Returns:
+            dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            "verified": self.verified,
+            "cache_hits": self.cache_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "verify_per_sec":
+            self.verified / self.verify_time if self.verify_time else 0.0
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -0,0 +1,353 @@
+"""Versioned binary encoding of the network messages exchanged by nodes.
+
+Every message starts with a fixed-size header (version, message type,
+sender) followed by the payload. Hashes are sent as raw 20-byte digests,
+signatures as raw bytes and transactions as length-prefixed canonical bytes.
+The canonical bytes of a transaction are also what its sender signs and
+what the Merkle tree hashes. A JSON form of the same messages is kept for
+debugging.
+"""
+import json
+import base64
+import struct
+from block import Block, BlockHeader
+from compact import CompactBlock
+from transaction import Transaction
+
+VERSION = 1
+
+MESSAGE_TYPES = {
+    'TRANSACTION': 1,
+    'BLOCK': 2,
+    'CMPCTBLOCK': 3,
+    'GETBLOCKTXN': 4,
+    'BLOCKTXN': 5,
+    'GETDATA': 6,
+    'GETHEADERS': 7,
+    'HEADERS': 8,
+    'GETBLOCKS': 9,
+    'BLOCKS': 10
+}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+# Messages relayed to the whole network. The others go to a single node.
+RELAYED_MESSAGES = {'TRANSACTION', 'CMPCTBLOCK'}
+# Messages exchanged with the author of a compact block to rebuild it
+REQUEST_MESSAGES = {'GETBLOCKTXN', 'BLOCKTXN', 'GETDATA'}
+# Messages exchanged with a single peer to download the blocks a node missed
+SYNC_MESSAGES = {'GETHEADERS', 'HEADERS', 'GETBLOCKS', 'BLOCKS'}
+# Messages carrying no signature of the sender. Compact blocks are
+# authenticated once rebuilt, by the signature of the full block. Synced
+# headers and blocks are checked by their proof of work and the signatures
+# of their transactions instead.
+UNSIGNED_MESSAGES = REQUEST_MESSAGES | SYNC_MESSAGES | {'CMPCTBLOCK'}
+
+# version, message type, sender
+ENVELOPE = struct.Struct('>BBI')
+U16 = struct.Struct('>H')
+U32 = struct.Struct('>I')
+
+
+class WireFormatException(Exception):
+    pass
+
+
+def _pack_long(data):
+    return U16.pack(len(data)) + data
+
+
+def _unpack_long(data, offset):
+    size, = U16.unpack_from(data, offset)
+    offset += 2
+    return data[offset:offset + size], offset + size
+
+
+def encode_message(sender, message, payload, debug=False):
+    """Encode a message to put on the queue of a node
+
+    Args:
+        sender (int): Node id of the sender
+        message (str): TRANSACTION/BLOCK/CMPCTBLOCK/GETBLOCKTXN/BLOCKTXN/
+            GETDATA/GETHEADERS/HEADERS/GETBLOCKS/BLOCKS
+        payload (dict): {"tx": Transaction, "signature": bytes} for a
+            transaction, {"blk": Block, "signature": bytes} for a block,
+            {"cmpct": CompactBlock, "signature": bytes} for a compact block
+            with the signature of the full block, {"hash": str,
+            "indexes": List[int]} to request transactions of a block,
+            {"hash": str, "txs": List[Transaction]} for the requested
+            transactions and {"hash": str} to request a full block.
+            Sync messages are {"locator": List[str]}, {"headers":
+            List[BlockHeader]}, {"hashes": List[str]} and {"blocks":
+            List[Block]}.
+        debug (bool, optional): Encode as human readable JSON instead.
+            Defaults to False.
+
+    Returns:
+        bytes, or str in debug mode
+    """
+    if debug:
+        return _encode_json(sender, message, payload)
+
+    envelope = ENVELOPE.pack(VERSION, MESSAGE_TYPES[message], sender)
+    if message in REQUEST_MESSAGES:
+        return envelope + _encode_request(message, payload)
+    if message in SYNC_MESSAGES:
+        return envelope + _encode_sync(message, payload)
+
+    if message == 'TRANSACTION':
+        body = _pack_long(payload['tx'].to_bytes())
+    elif message == 'CMPCTBLOCK':
+        body = payload['cmpct'].to_bytes()
+    else:
+        body = payload['blk'].to_bytes()
+    return b''.join([envelope, body, _pack_long(payload['signature'])])
+
+
+def _encode_request(message, payload):
+    """Body of the messages exchanged to rebuild a compact block"""
+    parts = [bytes.fromhex(payload['hash'])]
+    if message == 'GETBLOCKTXN':
+        parts.append(U32.pack(len(payload['indexes'])))
+        parts.extend(U32.pack(index) for index in payload['indexes'])
+    elif message == 'BLOCKTXN':
+        parts.append(U32.pack(len(payload['txs'])))
+        for tx in payload['txs']:
+            parts.append(_pack_long(tx.to_bytes()))
+            parts.append(_pack_long(tx.signature))
+    return b''.join(parts)
+
+
+def _decode_request(message, data, offset):
+    payload = {"hash": data[offset:offset + 20].hex()}
+    if len(payload['hash']) != 40:
+        raise ValueError('Truncated hash')
+    offset += 20
+    if message == 'GETBLOCKTXN':
+        count, = U32.unpack_from(data, offset)
+        payload['indexes'] = list(
+            struct.unpack_from('>%dI' % count, data, offset + U32.size))
+    elif message == 'BLOCKTXN':
+        count, = U32.unpack_from(data, offset)
+        offset += U32.size
+        txs = []
+        for _ in range(count):
+            tx_data, offset = _unpack_long(data, offset)
+            signature, offset = _unpack_long(data, offset)
+            txs.append(Transaction.from_bytes(tx_data, signature))
+        payload['txs'] = txs
+    return payload
+
+
+def _encode_sync(message, payload):
+    """Body of the messages downloading missed blocks"""
+    if message == 'GETHEADERS' or message == 'GETBLOCKS':
+        hashes = payload['locator' if message == 'GETHEADERS' else 'hashes']
+        return U32.pack(len(hashes)) + b''.join(
+            bytes.fromhex(block_hash) for block_hash in hashes)
+    items = payload['headers' if message == 'HEADERS' else 'blocks']
+    return U32.pack(len(items)) + b''.join(item.to_bytes() for item in items)
+
+
+def _decode_sync(message, data, offset):
+    count, = U32.unpack_from(data, offset)
+    offset += U32.size
+    if message == 'GETHEADERS' or message == 'GETBLOCKS':
+        hashes = [
+            data[start:start + 20].hex()
+            for start in range(offset, offset + 20 * count, 20)
+        ]
+        offset += 20 * count
+        payload = {
+            'locator' if message == 'GETHEADERS' else 'hashes': hashes
+        }
+    else:
+        parse = BlockHeader.from_bytes if message == 'HEADERS' else \
+            Block.from_bytes
+        items = []
+        for _ in range(count):
+            item, offset = parse(data, offset)
+            items.append(item)
+        payload = {'headers' if message == 'HEADERS' else 'blocks': items}
+    if offset > len(data):
+        raise ValueError('Truncated ' + message)
+    return payload
+
+
+def decode_message(data):
+    """Decode a message read from the queue of a node, in a single pass
+
+    Args:
+        data (bytes or str): Output of encode_message
+
+    Returns:
+        dict: {"sender", "message", "pl", "signed"} where pl has the format
+            taken by encode_message and signed holds the bytes the signature
+            is over, None for UNSIGNED_MESSAGES
+    """
+    if isinstance(data, str):
+        return _decode_json(data)
+
+    try:
+        version, code, sender = ENVELOPE.unpack_from(data)
+        if version != VERSION:
+            raise WireFormatException('Unsupported version ' + str(version))
+        message = MESSAGE_NAMES[code]
+
+        start = ENVELOPE.size
+        signed = None
+        if message in REQUEST_MESSAGES:
+            payload = _decode_request(message, data, start)
+        elif message in SYNC_MESSAGES:
+            payload = _decode_sync(message, data, start)
+        elif message == 'CMPCTBLOCK':
+            cmpct, offset = CompactBlock.from_bytes(data, start)
+            signature, _ = _unpack_long(data, offset)
+            payload = {"cmpct": cmpct, "signature": signature}
+        elif message == 'TRANSACTION':
+            signed, offset = _unpack_long(data, start)
+            signature, _ = _unpack_long(data, offset)
+            payload = {
+                "tx": Transaction.from_bytes(signed, signature),
+                "signature": signature
+            }
+        else:
+            block, offset = Block.from_bytes(data, start)
+            signed = data[start:offset]
+            signature, _ = _unpack_long(data, offset)
+            payload = {"blk": block, "signature": signature}
+    except (struct.error, KeyError, IndexError, ValueError) as e:
+        raise WireFormatException(str(e))
+
+    return {
+        "sender": sender,
+        "message": message,
+        "pl": payload,
+        "signed": signed
+    }
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+
+def _block_json(block):
+    blk = block.to_json()
+    blk['signatures'] = [_b64(signature) for signature in blk['signatures']]
+    return blk
+
+
+def _block_from_json(blk):
+    blk['signatures'] = [
+        base64.b64decode(signature) for signature in blk['signatures']
+    ]
+    return Block.from_json(blk)
+
+
+def _encode_json(sender, message, payload):
+    pl = {}
+    if 'signature' in payload:
+        pl['signature'] = _b64(payload['signature'])
+    if 'hash' in payload:
+        pl['hash'] = payload['hash']
+    if message == 'GETBLOCKTXN':
+        pl['indexes'] = payload['indexes']
+    elif message == 'BLOCKTXN':
+        pl['txs'] = [tx.to_json() for tx in payload['txs']]
+        pl['signatures'] = [_b64(tx.signature) for tx in payload['txs']]
+    elif message == 'CMPCTBLOCK':
+        cmpct = payload['cmpct'].to_json()
+        cmpct['signatures'] = [
+            _b64(signature) for signature in cmpct['signatures']
+        ]
+        pl['cmpct'] = cmpct
+    elif message == 'TRANSACTION':
+        pl['tx'] = payload['tx'].to_json()
+    elif message == 'BLOCK':
+        pl['blk'] = _block_json(payload['blk'])
+    elif message == 'GETHEADERS':
+        pl['locator'] = payload['locator']
+    elif message == 'HEADERS':
+        pl['headers'] = [header.to_json() for header in payload['headers']]
+    elif message == 'GETBLOCKS':
+        pl['hashes'] = payload['hashes']
+    elif message == 'BLOCKS':
+        pl['blocks'] = [_block_json(block) for block in payload['blocks']]
+    return json.dumps(
+        {
+            "version": VERSION,
+            "sender": sender,
+            "message": message,
+            "pl": pl
+        },
+        sort_keys=True)
+
+
+def _decode_json(data):
+    try:
+        obj = json.loads(data)
+        pl = obj['pl']
+        message = obj['message']
+        if message in REQUEST_MESSAGES:
+            payload = {"hash": pl['hash']}
+            if message == 'GETBLOCKTXN':
+                payload['indexes'] = pl['indexes']
+            elif message == 'BLOCKTXN':
+                payload['txs'] = [
+                    Transaction.from_json(tx, base64.b64decode(signature))
+                    for tx, signature in zip(pl['txs'], pl['signatures'])
+                ]
+            return {
+                "sender": obj['sender'],
+                "message": message,
+                "pl": payload,
+                "signed": None
+            }
+        if message in SYNC_MESSAGES:
+            if message == 'GETHEADERS':
+                payload = {"locator": pl['locator']}
+            elif message == 'HEADERS':
+                payload = {
+                    "headers": [
+                        BlockHeader.from_json(header)
+                        for header in pl['headers']
+                    ]
+                }
+            elif message == 'GETBLOCKS':
+                payload = {"hashes": pl['hashes']}
+            else:
+                payload = {
+                    "blocks": [_block_from_json(blk) for blk in pl['blocks']]
+                }
+            return {
+                "sender": obj['sender'],
+                "message": message,
+                "pl": payload,
+                "signed": None
+            }
+
+        signature = base64.b64decode(pl['signature'])
+        if message == 'CMPCTBLOCK':
+            cmpct = pl['cmpct']
+            cmpct['signatures'] = [
+                base64.b64decode(signature)
+                for signature in cmpct['signatures']
+            ]
+            payload = {"cmpct": CompactBlock.from_json(cmpct)}
+            signed = None
+        elif message == 'TRANSACTION':
+            tx = Transaction.from_json(pl['tx'], signature)
+            payload = {"tx": tx}
+            signed = tx.to_bytes()
+        else:
+            block = _block_from_json(pl['blk'])
+            payload = {"blk": block}
+            signed = block.to_bytes()
+        payload['signature'] = signature
+    except (TypeError, KeyError, ValueError) as e:
+        raise WireFormatException(str(e))
+
+    return {
+        "sender": obj['sender'],
+        "message": obj['message'],
+        "pl": payload,
+        "signed": signed
+    }